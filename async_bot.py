@@ -0,0 +1,370 @@
+import time
+
+# Measured from here when started directly (python async_bot.py)
+STARTUP_STARTED_AT = time.perf_counter()
+
+import sys
+import asyncio
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from datetime import timezone
+from supabase_utils import plan_catalog
+from async_supabase_utils import (
+    async_supabase_client,
+    save_photosession_order,
+    update_photosession_payment_status
+)
+from bot_content import (
+    PLAN_NOT_FOUND_TEXT,
+    RECEIPT_ACCEPTED_TEXT,
+    RECEIPT_REQUIRED_TEXT,
+    RECEIPT_ERROR_TEXT,
+    CHECKOUT_FIRST_TEXT,
+    PAYMENT_CONFIRMED_USER_TEXT,
+    USE_START_TEXT
+)
+from receipts import get_receipt, receipt_send_kwargs, download_receipt_async
+from notifications import AsyncNotificationDispatcher, get_admin_recipients, thread_kwargs
+from callback_router import RecentCallbacks
+from menus import MAIN_MENU, get_menu
+from funnel import Funnel, View, plan_menu_key, receipt_notification, confirmed_receipt_caption
+from state_store import create_state_store
+from send_queue import AsyncOutboundQueue, PRIORITY_HIGH, PRIORITY_NORMAL
+from health_check import start_health_server, record_startup_time, register_health_metric
+from bot_setup import (
+    TOKEN,
+    UPDATE_MODE,
+    MENU_NAVIGATION,
+    build_callback_router,
+    register_handlers,
+    create_drive_sync_executor,
+    create_drive_sync_trigger,
+    add_scheduled_jobs,
+    print_drive_sync_settings
+)
+
+# Async engine: same funnel as bot.py (decisions in funnel.py, only sending
+# and awaiting differ), running on AsyncTeleBot so one process can serve many
+# concurrent chats without a thread per in-flight request.
+# Start with BOT_MODE=async python bot.py (or python async_bot.py).
+
+# Built by create_app(); importing this module has no side effects
+bot = None
+state_store = None
+scheduler = None
+drive_sync_executor = None
+drive_sync_trigger = None
+admin_notifier = None
+outbox = None
+funnel = None
+callback_router = None
+
+async def run_drive_sync():
+    """Start or join a Drive sync and wait for it without blocking the event loop"""
+    future, _ = drive_sync_executor.submit()
+    return await asyncio.wrap_future(future)
+
+async def send_message(chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+    """Send through the rate-limited outbound queue and wait until it is delivered"""
+    return await outbox.submit(bot.send_message, chat_id, text, priority=priority, **kwargs)
+
+async def send_replies(chat_id, texts):
+    """Send a step's replies in order"""
+    for text in texts:
+        await send_message(chat_id, text)
+
+async def respond(call, reply):
+    """Show a funnel View in place of the tapped message, or send a text"""
+    if isinstance(reply, View):
+        await edit_or_send(call, reply.text, reply.reply_markup)
+    else:
+        await send_message(call.message.chat.id, reply)
+
+def has_pending_step(message):
+    return funnel.has_pending_step(message.chat.id)
+
+async def handle_next_step(message):
+    step, data = funnel.take_step(message.chat.id)
+    if step is not None:
+        await STEP_HANDLERS[step](message, data)
+
+async def show_menu(chat_id, key):
+    """Send a prebuilt menu node (text + serialized keyboard)"""
+    node = get_menu(key)
+    if node is None:
+        # A plan removed from the catalog since its button was sent
+        await send_message(chat_id, PLAN_NOT_FOUND_TEXT)
+        return
+    await send_message(chat_id, node.text, reply_markup=node.reply_markup)
+
+async def acknowledge(call, text=None):
+    """Answer a callback query right away so the client stops its spinner"""
+    try:
+        await bot.answer_callback_query(call.id, text)
+    except Exception as e:
+        print(f"Error answering callback query: {e}")
+
+async def edit_or_send(call, text, reply_markup=None):
+    """
+    Replace the tapped message with text and keyboard by editing it in place;
+    send a new message when it can't be edited (media, too old, deleted).
+    """
+    chat_id = call.message.chat.id
+    if MENU_NAVIGATION != 'edit' or call.message.content_type != 'text':
+        await send_message(chat_id, text, reply_markup=reply_markup)
+        return
+
+    message_id = call.message.message_id
+    try:
+        await outbox.submit(
+            lambda chat_id: bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup),
+            chat_id
+        )
+    except Exception as e:
+        # Tapping the button of the message already shown
+        if 'message is not modified' in str(e):
+            return
+        print(f"Editing message in place failed, sending it instead: {e}")
+        await send_message(chat_id, text, reply_markup=reply_markup)
+
+async def navigate_to(call, key):
+    """Show a menu node for a tapped button, in place of the tapped message"""
+    node = get_menu(key)
+    if node is None:
+        await show_menu(call.message.chat.id, key)
+        return
+    await edit_or_send(call, node.text, node.reply_markup)
+
+async def send_welcome(message):
+    await show_menu(message.chat.id, MAIN_MENU)
+
+# Any node of the menu tree: main menu, prices, categories, plan details
+async def handle_menu(call, argument):
+    await acknowledge(call)
+    await navigate_to(call, call.data)
+
+# Plan buttons sent before the menu tree (buy_<plan>)
+async def handle_plan_selection(call, argument):
+    await acknowledge(call)
+    key = plan_menu_key(argument)
+    if key is None:
+        await send_message(call.message.chat.id, PLAN_NOT_FOUND_TEXT)
+        return
+    await navigate_to(call, key)
+
+async def handle_payment_initiation(call, argument):
+    await acknowledge(call)
+    await respond(call, funnel.start_cart(call.message.chat.id, argument))
+
+async def handle_cart_add(call, argument):
+    await acknowledge(call)
+    await respond(call, funnel.change_cart_item(call.message.chat.id, argument, 1))
+
+async def handle_cart_remove(call, argument):
+    await acknowledge(call)
+    await respond(call, funnel.change_cart_item(call.message.chat.id, argument, -1))
+
+async def handle_checkout(call, argument):
+    await acknowledge(call)
+    await respond(call, funnel.checkout(call.message.chat.id))
+
+async def process_full_name(message, data):
+    await send_replies(message.chat.id, funnel.accept_full_name(message.chat.id, data, message.text))
+
+async def process_phone(message, data):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    replies = funnel.accept_phone(chat_id, data, message.text, username)
+    if replies is None:
+        # Save the registration with its order and line items in one request;
+        # Supabase prices the items and returns the total
+        order = await save_photosession_order(data, chat_id, username)
+        replies = funnel.order_saved(chat_id, data, order)
+    await send_replies(chat_id, replies)
+
+async def send_receipt_to_admin(recipient, receipt, caption, markup):
+    """Forward the receipt by file_id; re-upload downloaded bytes only if Telegram rejects it"""
+    send = bot.send_photo if receipt.kind == 'photo' else bot.send_document
+    kwargs = dict(caption=caption, reply_markup=markup, **thread_kwargs(recipient))
+    try:
+        await outbox.submit(send, recipient.chat_id, priority=PRIORITY_HIGH, **kwargs, **receipt_send_kwargs(receipt))
+    except ApiTelegramException as e:
+        # Rate limits and blocked chats are left to the dispatcher's retry policy
+        if e.error_code != 400:
+            raise
+        print(f"Forwarding receipt by file_id failed, re-uploading it: {e}")
+        with await download_receipt_async(bot, receipt) as content:
+            await outbox.submit(send, recipient.chat_id, priority=PRIORITY_HIGH, **kwargs, **receipt_send_kwargs(receipt, content))
+
+async def process_payment_receipt(message, data):
+    chat_id = message.chat.id
+    receipt = get_receipt(message)
+    if receipt is None:
+        await send_message(chat_id, RECEIPT_REQUIRED_TEXT)
+        return
+
+    try:
+        # Built before the customer is told the receipt was accepted
+        notification = receipt_notification(data)
+        if notification is None:
+            # A photo sent from the cart screen, before the order was saved
+            await send_message(chat_id, CHECKOUT_FIRST_TEXT)
+            return
+        caption, markup = notification
+
+        await send_message(chat_id, RECEIPT_ACCEPTED_TEXT)
+
+        # Notify all admins concurrently in background tasks
+        admin_notifier.dispatch(
+            lambda recipient: send_receipt_to_admin(recipient, receipt, caption, markup),
+            'payment receipt'
+        )
+
+    except Exception as e:
+        print(f"Error processing payment receipt: {e}")
+        await send_message(chat_id, RECEIPT_ERROR_TEXT)
+
+# Funnel steps by the name persisted in the state store
+STEP_HANDLERS = {
+    'full_name': process_full_name,
+    'phone': process_phone,
+    'receipt': process_payment_receipt
+}
+
+async def mark_receipt_confirmed(call):
+    """
+    Mark the admin's receipt message confirmed and remove its button, through
+    the outbound queue; a failed edit is only logged.
+    """
+    message_id = call.message.message_id
+    caption = confirmed_receipt_caption(call.message.caption)
+    try:
+        await outbox.submit(
+            lambda chat_id: bot.edit_message_caption(caption, chat_id, message_id, reply_markup=None),
+            call.message.chat.id,
+            priority=PRIORITY_HIGH
+        )
+    except Exception as e:
+        print(f"Error marking receipt confirmed: {e}")
+
+async def handle_payment_confirmation(call, argument):
+    """Handle payment confirmation from admin; only the first confirmation takes effect"""
+    try:
+        # Mark the registration paid unless an earlier tap (this or another admin's copy) already did
+        confirmation = funnel.payment_confirmed(await update_photosession_payment_status(argument))
+        await acknowledge(call, confirmation.answer)
+        if confirmation.mark_confirmed:
+            await mark_receipt_confirmed(call)
+        if confirmation.customer_chat_id:
+            await send_message(confirmation.customer_chat_id, PAYMENT_CONFIRMED_USER_TEXT, priority=PRIORITY_HIGH)
+
+    except Exception as e:
+        print(f"Error in payment confirmation: {e}")
+        await acknowledge(call, "❌ Произошла ошибка.")
+
+async def handle_photo(message):
+    chat_id = message.chat.id
+    data = funnel.draft(chat_id)
+    if data is not None:
+        # This is a payment receipt for photosession registration
+        await process_payment_receipt(message, data)
+    else:
+        await send_message(chat_id, USE_START_TEXT)
+
+# TESTING: Command to manually trigger Google Drive sync
+async def test_sync(message):
+    future, joined = drive_sync_executor.submit()
+    if joined:
+        await send_message(message.chat.id, "⏳ A Google Drive sync is already running, waiting for it to finish...")
+    else:
+        await send_message(message.chat.id, "🔄 Starting manual Google Drive sync...")
+    status = await asyncio.wrap_future(future)
+    await send_message(message.chat.id, f"✅ Manual sync completed! ({status})")
+
+async def reload_plans(message):
+    """Admin command: reload the plan catalog from Supabase now, off the event loop"""
+    chat_id = message.chat.id
+    if chat_id not in {recipient.chat_id for recipient in admin_notifier.recipients}:
+        return
+    snapshot = await asyncio.to_thread(plan_catalog.refresh)
+    await send_message(chat_id, f"✅ Plan catalog v{snapshot.version}: {len(snapshot.plans)} plans")
+
+# The same callback query delivered twice is handled once
+recent_callbacks = RecentCallbacks()
+
+async def handle_callback(call):
+    """Single callback query handler: one dict lookup through the route table"""
+    # The same callback query delivered twice is handled (and written) once
+    if not recent_callbacks.first_seen(call.id):
+        print(f"Duplicate callback query {call.id} ignored: {call.data}")
+        return
+    handler, argument = callback_router.resolve(call.data)
+    if handler is None:
+        print(f"Unhandled callback: {call.data}")
+        await acknowledge(call)
+        return
+    await handler(call, argument)
+
+def create_app():
+    """
+    Build the bot, state store, scheduler and Drive sync plumbing.
+    The scheduler is returned unstarted (it needs the running event loop).
+    """
+    global bot, state_store, scheduler, drive_sync_executor, drive_sync_trigger, admin_notifier, outbox, funnel, callback_router
+
+    bot = AsyncTeleBot(TOKEN)
+    handlers = sys.modules[__name__]
+    register_handlers(bot, handlers)
+    callback_router = build_callback_router(handlers)
+
+    # Every send goes through one queue honouring Telegram's flood limits
+    outbox = AsyncOutboundQueue()
+    register_health_metric('send_queue_depth', lambda: outbox.depth)
+
+    # Draft registration and pending funnel step per chat; AsyncTeleBot has no
+    # register_next_step_handler, so steps are dispatched by handle_next_step
+    state_store = create_state_store()
+
+    # Admin chats/topics notified about new receipts (ADMIN_CHAT_IDS or ADMIN_CHAT_ID)
+    admin_notifier = AsyncNotificationDispatcher(get_admin_recipients())
+
+    # The trigger fires on a timer thread, so the debounced sync also runs off the event loop
+    drive_sync_executor = create_drive_sync_executor()
+    drive_sync_trigger = create_drive_sync_trigger(drive_sync_executor)
+
+    # Synchronous jobs (catalog refresh, purge) run on the loop's thread pool
+    scheduler = AsyncIOScheduler(timezone=timezone.utc)
+    add_scheduled_jobs(scheduler, run_drive_sync, state_store)
+
+    # Step transitions and cart/order decisions shared with the other engine
+    funnel = Funnel(state_store, drive_sync_trigger)
+    return bot, scheduler
+
+async def main(started_at=STARTUP_STARTED_AT):
+    if UPDATE_MODE == 'webhook':
+        raise ValueError("UPDATE_MODE=webhook is not supported by the async engine; "
+                         "use UPDATE_MODE=polling or BOT_MODE=sync")
+    create_app()
+    print("Bot is polling (async engine)...")
+    print_drive_sync_settings()
+    scheduler.start()
+
+    # Start health check server for Railway
+    try:
+        start_health_server()
+        print("✅ Health check server started")
+    except Exception as e:
+        print(f"⚠️ Health check server failed to start: {e}")
+
+    # Drop a webhook left over from a previous webhook deployment, otherwise
+    # getUpdates fails with 409 Conflict
+    await bot.remove_webhook()
+    record_startup_time(started_at)
+    try:
+        await bot.polling(non_stop=True)
+    finally:
+        await async_supabase_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
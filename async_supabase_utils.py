@@ -0,0 +1,137 @@
+import asyncio
+from json import loads
+import aiohttp
+from supabase_utils import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    PHOTOSESSION_REGISTRATIONS_TABLE,
+    RETRY_STATUSES,
+    CREATE_ORDER_RPC,
+    build_photosession_order_request
+)
+
+class AsyncSupabaseClient:
+    """
+    Async counterpart of SupabaseClient for the AsyncTeleBot engine.
+    Holds one pooled aiohttp.ClientSession (created lazily inside the running
+    event loop) with the same timeout and retry/backoff policy.
+    """
+
+    def __init__(self, url, api_key, pool_size=100, timeout=10, max_retries=3, backoff_factor=0.5):
+        self.base_url = f"{url}/rest/v1"
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._session = None
+
+    def endpoint(self, table):
+        """Build the REST endpoint URL for a table"""
+        return f"{self.base_url}/{table}"
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "apikey": self.api_key,
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout
+            )
+        return self._session
+
+    def _should_retry(self, method, status_code):
+        # Same rule as the sync client: never replay an insert on 5xx
+        if method == 'POST':
+            return status_code == 429
+        return status_code in RETRY_STATUSES
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    async def request(self, method, table, params=None, json=None, headers=None):
+        """
+        Send a request to a table endpoint with retry/backoff.
+        Returns (status_code, parsed JSON body or None).
+        """
+        method = method.upper()
+        url = self.endpoint(table)
+        session = self._get_session()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.request(method, url, params=params, json=json, headers=headers) as response:
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+                    text = await response.text()
+            except aiohttp.ClientConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+
+            if attempt < self.max_retries and self._should_retry(method, status):
+                print(f"Supabase {method} {table} returned {status}, retrying...")
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+                continue
+            if status >= 400:
+                print(f"Supabase {method} {table} failed: {status} {text}")
+                return status, None
+            return status, (loads(text) if text else None)
+
+    async def get(self, table, params=None, **kwargs):
+        return await self.request('GET', table, params=params, **kwargs)
+
+    async def post(self, table, json=None, **kwargs):
+        return await self.request('POST', table, json=json, **kwargs)
+
+    async def patch(self, table, json=None, params=None, **kwargs):
+        return await self.request('PATCH', table, params=params, json=json, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+# Shared client used by all async helpers below
+async_supabase_client = AsyncSupabaseClient(SUPABASE_URL, SUPABASE_KEY)
+
+async def save_photosession_order(user_data, telegram_id, username=None):
+    """Async version of supabase_utils.save_photosession_order_to_supabase"""
+    data = build_photosession_order_request(user_data, telegram_id, username)
+    if not data:
+        return None
+
+    try:
+        status, order = await async_supabase_client.post(CREATE_ORDER_RPC, json=data)
+        if status == 200 and order:
+            print(f"Photosession order {order.get('order_id')} saved to Supabase, total {order.get('total')}.")
+            return order
+        return None
+    except Exception as e:
+        print(f"Exception during Supabase photosession order: {e}")
+        return None
+
+async def update_photosession_payment_status(registration_id):
+    """
+    Async version of supabase_utils.update_photosession_payment_status:
+    the registration record if this call marked it paid, None if it was
+    already paid, False on failure.
+    """
+    try:
+        status, registrations = await async_supabase_client.patch(
+            PHOTOSESSION_REGISTRATIONS_TABLE,
+            json={"is_paid": True},
+            params={"id": f"eq.{registration_id}", "is_paid": "eq.false"},
+            headers={"Prefer": "return=representation"}
+        )
+        if status != 200:
+            return False
+        return registrations[0] if registrations else None
+    except Exception as e:
+        print(f"Exception during payment status update: {e}")
+        return False
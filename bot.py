@@ -1,481 +1,402 @@
+import time
+
+# Measured from here, before the heavier imports below
+STARTUP_STARTED_AT = time.perf_counter()
+
 import os
-from dotenv import load_dotenv
+import sys
 import telebot
-from telebot import types
 from supabase_utils import (
-    save_photosession_registration_to_supabase, 
-    update_photosession_payment_status, 
-    get_photosession_registration_by_id, 
-    get_latest_photosession_registration_by_telegram_id, 
-    fetch_photosession_registrations,
-    get_plan_by_id,
-    get_all_plans,
-    sync_photosession_registrations_to_drive
+    save_photosession_order_to_supabase,
+    update_photosession_payment_status,
+    plan_catalog
+)
+from bot_content import (
+    PLAN_NOT_FOUND_TEXT,
+    RECEIPT_ACCEPTED_TEXT,
+    RECEIPT_REQUIRED_TEXT,
+    RECEIPT_ERROR_TEXT,
+    CHECKOUT_FIRST_TEXT,
+    PAYMENT_CONFIRMED_USER_TEXT,
+    USE_START_TEXT
 )
-from datetime import datetime, timedelta, timezone
+from datetime import timezone
 from apscheduler.schedulers.background import BackgroundScheduler
-from health_check import start_health_server
-import re
-
-# Load environment variables from .env file
-load_dotenv()
-TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-
-# Easily editable sync interval (in minutes)
-SYNC_INTERVAL_MINUTES = 30
-
-bot = telebot.TeleBot(TOKEN)
-
-# Store user registration data temporarily
-user_data = {}
+from receipts import get_receipt, receipt_send_kwargs, download_receipt
+from notifications import NotificationDispatcher, get_admin_recipients, thread_kwargs
+from callback_router import RecentCallbacks
+from menus import MAIN_MENU, get_menu
+from funnel import Funnel, View, plan_menu_key, receipt_notification, confirmed_receipt_caption
+from state_store import create_state_store
+from send_queue import OutboundQueue, PRIORITY_HIGH, PRIORITY_NORMAL
+from health_check import start_health_server, enable_webhook, record_startup_time, register_health_metric, WEBHOOK_PATH
+from bot_setup import (
+    TOKEN,
+    UPDATE_MODE,
+    MENU_NAVIGATION,
+    build_callback_router,
+    register_handlers,
+    create_drive_sync_executor,
+    create_drive_sync_trigger,
+    add_scheduled_jobs,
+    print_drive_sync_settings
+)
 
-# APScheduler setup
-scheduler = BackgroundScheduler(timezone=timezone.utc)
-scheduler.start()
+# Engine selection: 'sync' (TeleBot, default) or 'async' (AsyncTeleBot, see async_bot.py)
+BOT_MODE = os.getenv('BOT_MODE', 'sync').lower()
+
+# Webhook mode (UPDATE_MODE=webhook, see bot_setup.py)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public base URL, e.g. https://<app>.up.railway.app
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 2))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+
+# Built by create_app(); importing this module has no side effects
+bot = None
+state_store = None
+scheduler = None
+drive_sync_executor = None
+drive_sync_trigger = None
+admin_notifier = None
+outbox = None
+funnel = None
+callback_router = None
+
+def send_message(chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+    """Queue a message on the rate-limited outbound queue; returns a Future"""
+    return outbox.submit(bot.send_message, chat_id, text, priority=priority, **kwargs)
+
+def send_replies(chat_id, texts):
+    """Queue a step's replies in order"""
+    for text in texts:
+        send_message(chat_id, text)
+
+def respond(call, reply):
+    """Show a funnel View in place of the tapped message, or send a text"""
+    if isinstance(reply, View):
+        edit_or_send(call, reply.text, reply.reply_markup)
+    else:
+        send_message(call.message.chat.id, reply)
+
+def has_pending_step(message):
+    return funnel.has_pending_step(message.chat.id)
+
+def handle_next_step(message):
+    step, data = funnel.take_step(message.chat.id)
+    if step is not None:
+        STEP_HANDLERS[step](message, data)
+
+def show_menu(chat_id, key):
+    """Send a prebuilt menu node (text + serialized keyboard)"""
+    node = get_menu(key)
+    if node is None:
+        # A plan removed from the catalog since its button was sent
+        send_message(chat_id, PLAN_NOT_FOUND_TEXT)
+        return
+    send_message(chat_id, node.text, reply_markup=node.reply_markup)
 
-# Schedule Google Drive sync every SYNC_INTERVAL_MINUTES
-scheduler.add_job(sync_photosession_registrations_to_drive, 'interval', minutes=SYNC_INTERVAL_MINUTES)
+def acknowledge(call, text=None):
+    """Answer a callback query right away so the client stops its spinner"""
+    try:
+        bot.answer_callback_query(call.id, text)
+    except Exception as e:
+        print(f"Error answering callback query: {e}")
 
-# Input validation functions
-def validate_phone_number(phone):
-    """
-    Validate Kazakhstan phone number format.
-    Accepts: +7 707 123 45 67, 87071234567, 8 (707) 123-45-67, +77071234567
+def edit_or_send(call, text, reply_markup=None):
     """
-    # Remove all non-digit characters except +
-    cleaned = re.sub(r'[^\d+]', '', phone)
-    
-    # Check for valid Kazakhstan mobile number patterns
-    patterns = [
-        r'^\+77\d{9}$',  # +77071234567
-        r'^87\d{9}$',    # 87071234567
-    ]
-    
-    for pattern in patterns:
-        if re.match(pattern, cleaned):
-            return True
-    
-    return False
-
-def format_phone_number(phone):
+    Replace the tapped message with text and keyboard by editing it in place;
+    send a new message when it can't be edited (media, too old, deleted).
     """
-    Format phone number to standard Kazakhstan format: +7 7XX XXX XX XX
-    """
-    # Remove all non-digit characters
-    cleaned = re.sub(r'[^\d]', '', phone)
-    
-    # If it starts with 8, replace with +7
-    if cleaned.startswith('8'):
-        cleaned = '7' + cleaned[1:]
-    
-    # If it doesn't start with 7, add +7
-    if not cleaned.startswith('7'):
-        cleaned = '7' + cleaned
-    
-    # Format as +7 7XX XXX XX XX
-    if len(cleaned) == 11 and cleaned.startswith('7'):
-        return f"+7 {cleaned[1:4]} {cleaned[4:7]} {cleaned[7:9]} {cleaned[9:11]}"
-    
-    return phone  # Return original if can't format
-
-@bot.message_handler(commands=['start'])
+    chat_id = call.message.chat.id
+    if MENU_NAVIGATION != 'edit' or call.message.content_type != 'text':
+        send_message(chat_id, text, reply_markup=reply_markup)
+        return
+
+    message_id = call.message.message_id
+    future = outbox.submit(
+        lambda chat_id: bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup),
+        chat_id
+    )
+
+    def fall_back_to_send(completed):
+        error = completed.exception()
+        # Tapping the button of the message already shown
+        if error is None or 'message is not modified' in str(error):
+            return
+        print(f"Editing message in place failed, sending it instead: {error}")
+        send_message(chat_id, text, reply_markup=reply_markup)
+
+    future.add_done_callback(fall_back_to_send)
+
+def navigate_to(call, key):
+    """Show a menu node for a tapped button, in place of the tapped message"""
+    node = get_menu(key)
+    if node is None:
+        show_menu(call.message.chat.id, key)
+        return
+    edit_or_send(call, node.text, node.reply_markup)
+
 def send_welcome(message):
-    markup = types.InlineKeyboardMarkup()
-    prices_btn = types.InlineKeyboardButton('🔍 Посмотреть цены', callback_data='see_prices')
-    buy_btn = types.InlineKeyboardButton('🛒 Купить фотосессию', callback_data='buy_session')
-    markup.add(prices_btn, buy_btn)
-    
-    welcome_text = """👋 Добро пожаловать!
-        Я ваш помощник по бронированию фотосессий. 
-        Выберите, что хотите сделать:"""
-    
-    bot.send_message(message.chat.id, welcome_text, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'see_prices')
-def handle_see_prices(call):
-    prices_text = """📸 Пакеты фотосъёмки в парящих платьях — Астана
-
-⸻
-
-💫 Solo Базовый — ₸200 000 
-
-Включено:
-• 1 парящее платье
-• Макияж и прическа
-• Все снимки без обработки (в течение 3-4 дней после съемки) 
-• 5 обработанных фотографий (в течение 4 недель после съемки)
-• Ассистент (входит во все пакеты - помогает надевать платье, подгоняет под фигуру, работает с подолом и образом во время съемки) 
-
-⸻
-
-👑 Premium Solo — ₸280 000 
-
-Включено:
-• 1 парящее платье
-• Макияж и причёска
-• Все снимки без обработки (в течение 3-4 дней после съемки) 
-• 12 обработанных фото (приоритетная обработка, в течение 10 дней после съемки)
-• Ассистент (входит во все пакеты - полный функционал) 
-
-⸻
-
-🥇VIP — ₸360 000 
-
-Включено:
-• 2 парящих платья (смена образа во время съемки) 
-• Макияж и причёска
-• Все снимки без обработки (в течение 3-4 дней после съемки) 
-• 25 обработанных фото (в течение 4 недель)
-• Приоритетная дата съемки
-• Ассистент (входит во все пакеты - полный функционал) 
-
-⸻
-
-👩‍👧 Два поколения — ₸360 000
-
-Включено:
-• 1 парящее платье на каждую участницу
-• Макияж и прическа для обеих
-• Все снимки без обработки (в течение 3–4 дней после съемки)
-• 15 обработанных фото (в течение 4 недель)
-• Ассистент (помощь с образами, подолом, позированием)
-
-👩‍👧‍👵 Три поколения — ₸440 000
-
-Включено:
-• 1 парящее платье на каждую участницу
-• Макияж и прическа для трёх
-• Все снимки без обработки (в течение 3–4 дней после съемки)
-• 20 обработанных фото (в течение 4 недель)
-• Ассистент (работает с каждой участницей)
-
-🎯 Дополнительные услуги (по желанию)
-
-• Видео Reels / короткое видео (15–30 сек): ₸70 000  
-• Дополнительное платье: ₸25 000 
-• Реквизит (диадема, шары, дым, лепестки и т.п.): ₸10 000 – ₸30 000 
-• Дополнительное обработанное фото: ₸5 000 за 1 шт."""
-
-    markup = types.InlineKeyboardMarkup()
-    main_menu_btn = types.InlineKeyboardButton('🔙 Главное меню', callback_data='main_menu')
-    markup.add(main_menu_btn)
-    bot.send_message(call.message.chat.id, prices_text, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'buy_session')
-def handle_buy_session(call):
-    markup = types.InlineKeyboardMarkup()
-    solo_btn = types.InlineKeyboardButton('📸 Solo', callback_data='buy_solo')
-    duo_btn = types.InlineKeyboardButton('👯 Duo', callback_data='buy_duo')
-    trio_btn = types.InlineKeyboardButton('👩‍👩‍👧 Trio', callback_data='buy_trio')
-    extra_btn = types.InlineKeyboardButton('✨ Доп. услуги', callback_data='buy_extra')
-    main_menu_btn = types.InlineKeyboardButton('🔙 Главное меню', callback_data='main_menu')
-    markup.add(solo_btn, duo_btn, trio_btn, extra_btn, main_menu_btn)
-    
-    course_text = """Выберите, какую фотосессию вы хотите заказать:"""
-    
-    bot.send_message(call.message.chat.id, course_text, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'main_menu')
-def handle_main_menu(call):
-    markup = types.InlineKeyboardMarkup()
-    prices_btn = types.InlineKeyboardButton('🔍 Посмотреть цены', callback_data='see_prices')
-    buy_btn = types.InlineKeyboardButton('🛒 Купить фотосессию', callback_data='buy_session')
-    markup.add(prices_btn, buy_btn)
-    
-    welcome_text = """👋 Добро пожаловать!
-        Я ваш помощник по бронированию фотосессий. 
-        Выберите, что хотите сделать:"""
-    
-    bot.send_message(call.message.chat.id, welcome_text, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'buy_solo')
-def handle_buy_solo(call):
-    markup = types.InlineKeyboardMarkup()
-    solo1_btn = types.InlineKeyboardButton('💫 Solo Базовый', callback_data='buy_solo1')
-    solo2_btn = types.InlineKeyboardButton('👑 Premium Solo', callback_data='buy_solo2')
-    solo3_btn = types.InlineKeyboardButton('🥇VIP', callback_data='buy_solo3')
-    back_btn = types.InlineKeyboardButton('🔙 Назад', callback_data='buy_session')
-    
-    markup.add(back_btn, solo1_btn, solo2_btn, solo3_btn)
-    
-    bot.send_message(call.message.chat.id, "Выберите, какую фотосессию вы хотите заказать:", reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'buy_duo')
-def handle_buy_duo(call):
-    markup = types.InlineKeyboardMarkup()
-    duo_btn = types.InlineKeyboardButton('👩‍👧 Два поколения', callback_data='buy_duo_plan')
-    back_btn = types.InlineKeyboardButton('🔙 Назад', callback_data='buy_session')
-    
-    markup.add(back_btn, duo_btn)
-    
-    bot.send_message(call.message.chat.id, "Выберите, какую фотосессию вы хотите заказать:", reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'buy_trio')
-def handle_buy_trio(call):
-    markup = types.InlineKeyboardMarkup()
-    trio_btn = types.InlineKeyboardButton('👩‍👧‍👵 Три поколения', callback_data='buy_trio_plan')
-    back_btn = types.InlineKeyboardButton('🔙 Назад', callback_data='buy_session')
-    
-    markup.add(back_btn, trio_btn)
-    
-    bot.send_message(call.message.chat.id, "Выберите, какую фотосессию вы хотите заказать:", reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == 'buy_extra')
-def handle_buy_extra(call):
-    markup = types.InlineKeyboardMarkup()
-    extra1_btn = types.InlineKeyboardButton('Видео Reels / короткое видео (15–30 сек)', callback_data='buy_extra1')
-    extra2_btn = types.InlineKeyboardButton('Дополнительное платье', callback_data='buy_extra2')
-    extra3_btn = types.InlineKeyboardButton('Дополнительное обработанное фото', callback_data='buy_extra3')
-    back_btn = types.InlineKeyboardButton('🔙 Назад', callback_data='buy_session')
-    
-    markup.add(back_btn, extra1_btn, extra2_btn, extra3_btn)
-    
-    bot.send_message(call.message.chat.id, "Выберите, что вы хотите заказать:", reply_markup=markup)
-
-# Handle all plan selections
-@bot.callback_query_handler(func=lambda call: call.data.startswith('buy_'))
-def handle_plan_selection(call):
-    plan_id = call.data.replace('buy_', '')
-    
-    # Handle special cases for duo and trio
-    if plan_id == 'duo_plan':
-        plan_id = 'duo'
-    elif plan_id == 'trio_plan':
-        plan_id = 'trio'
-    
-    plan = get_plan_by_id(plan_id)
-    
-    if not plan:
-        bot.send_message(call.message.chat.id, "❌ План не найден. Пожалуйста, попробуйте снова.")
+    show_menu(message.chat.id, MAIN_MENU)
+
+# Any node of the menu tree: main menu, prices, categories, plan details
+def handle_menu(call, argument):
+    acknowledge(call)
+    navigate_to(call, call.data)
+
+# Plan buttons sent before the menu tree (buy_<plan>)
+def handle_plan_selection(call, argument):
+    acknowledge(call)
+    key = plan_menu_key(argument)
+    if key is None:
+        send_message(call.message.chat.id, PLAN_NOT_FOUND_TEXT)
         return
-    
-    markup = types.InlineKeyboardMarkup()
-    pay_btn = types.InlineKeyboardButton('🔐 Оплатить', callback_data=f'pay_{plan_id}')
-    back_btn = types.InlineKeyboardButton('🔙 Назад', callback_data='buy_session')
-    markup.add(pay_btn, back_btn)
-    
-    payment_text = f"""💰 Полная стоимость: ₸{plan['price']:,}
-📋 {plan['description']}
-
-💵 Оплата на Kaspi / переводом  
-📍 Место бронируется после оплаты
-
-Есть вопросы? Напиши нам в Instagram или WhatsApp:
-📸 @wowmotion_photo_video
-📞 +7 (706) 651-22-93, +7 (705) 705-82-75
-Мы на связи и рады помочь!"""
-    
-    bot.send_message(call.message.chat.id, payment_text, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('pay_'))
-def handle_payment_initiation(call):
-    plan_id = call.data.replace('pay_', '')
-    chat_id = call.message.chat.id
-    
-    # Store user data
-    user_data[chat_id] = {'type': plan_id}
-    
-    bot.send_message(chat_id, "Для регистрации на фотосессию, пожалуйста, напишите ваше полное имя:")
-    bot.register_next_step_handler_by_chat_id(chat_id, process_full_name)
-
-def process_full_name(message):
-    chat_id = message.chat.id
-    user_data[chat_id]['full_name'] = message.text
-    bot.send_message(chat_id, "Пожалуйста, напишите свой номер телефона:")
-    bot.register_next_step_handler_by_chat_id(chat_id, process_phone)
+    navigate_to(call, key)
+
+def handle_payment_initiation(call, argument):
+    acknowledge(call)
+    respond(call, funnel.start_cart(call.message.chat.id, argument))
+
+def handle_cart_add(call, argument):
+    acknowledge(call)
+    respond(call, funnel.change_cart_item(call.message.chat.id, argument, 1))
+
+def handle_cart_remove(call, argument):
+    acknowledge(call)
+    respond(call, funnel.change_cart_item(call.message.chat.id, argument, -1))
 
-def process_phone(message):
+def handle_checkout(call, argument):
+    acknowledge(call)
+    respond(call, funnel.checkout(call.message.chat.id))
+
+def process_full_name(message, data):
+    send_replies(message.chat.id, funnel.accept_full_name(message.chat.id, data, message.text))
+
+def process_phone(message, data):
+    chat_id = message.chat.id
+    username = message.from_user.username
+    replies = funnel.accept_phone(chat_id, data, message.text, username)
+    if replies is None:
+        # Save the registration with its order and line items in one request;
+        # Supabase prices the items and returns the total
+        order = save_photosession_order_to_supabase(data, chat_id, username)
+        replies = funnel.order_saved(chat_id, data, order)
+    send_replies(chat_id, replies)
+
+def send_receipt_to_admin(recipient, receipt, caption, markup):
+    """Forward the receipt by file_id; re-upload downloaded bytes only if Telegram rejects it"""
+    send = bot.send_photo if receipt.kind == 'photo' else bot.send_document
+    kwargs = dict(caption=caption, reply_markup=markup, **thread_kwargs(recipient))
+    try:
+        outbox.submit(send, recipient.chat_id, priority=PRIORITY_HIGH, **kwargs, **receipt_send_kwargs(receipt)).result()
+    except telebot.apihelper.ApiTelegramException as e:
+        # Rate limits and blocked chats are left to the dispatcher's retry policy
+        if e.error_code != 400:
+            raise
+        print(f"Forwarding receipt by file_id failed, re-uploading it: {e}")
+        with download_receipt(bot, receipt) as content:
+            outbox.submit(send, recipient.chat_id, priority=PRIORITY_HIGH, **kwargs, **receipt_send_kwargs(receipt, content)).result()
+
+def process_payment_receipt(message, data):
     chat_id = message.chat.id
-    phone = message.text.strip()
-    
-    # Validate phone number
-    if not validate_phone_number(phone):
-        bot.send_message(chat_id, "🚫 Пожалуйста, введите корректный номер телефона (пример: +77011234567)")
-        bot.register_next_step_handler_by_chat_id(chat_id, process_phone)
+    receipt = get_receipt(message)
+    if receipt is None:
+        send_message(chat_id, RECEIPT_REQUIRED_TEXT)
         return
-    
-    # Format phone number to standard format
-    formatted_phone = format_phone_number(phone)
-    user_data[chat_id]['phone'] = formatted_phone
-    user_data[chat_id]['telegram_username'] = message.from_user.username
-    
-    # Save photosession registration to Supabase
-    success = save_photosession_registration_to_supabase(user_data[chat_id], chat_id, message.from_user.username)
-    
-    if success:
-        # Fetch the registration ID from the database
-        registration = get_latest_photosession_registration_by_telegram_id(chat_id)
-        
-        if registration and registration.get('id'):
-            registration_id = registration['id']
-            user_data[chat_id]['registration_id'] = registration_id
-            print(f"Retrieved registration ID from database: {registration_id}")
-        else:
-            print("Warning: Could not retrieve registration ID from database")
-            user_data[chat_id]['registration_id'] = None
-        
-        # Get plan details for payment instructions
-        plan = get_plan_by_id(user_data[chat_id]['type'])
-        
-        bot.send_message(chat_id, "✅ Регистрация на фотосессию прошла успешно!")
-        
-        # Send payment instructions
-        payment_instructions = f"""💳 ИНСТРУКЦИИ ПО ОПЛАТЕ
-
-💰 Стоимость: ₸{plan['price']:,}
-
-📱 Оплата через Kaspi:
-• Ссылка: https://pay.kaspi.kz/pay/s6llvgtb
-• Получатель: WowMotion
-• Назначение: Фотосессия {plan['name']}
-
-📸 После оплаты, пожалуйста, отправьте фото чека для подтверждения."""
-        
-        bot.send_message(chat_id, payment_instructions)
-        bot.send_message(chat_id, "📸 Отправьте фото чека об оплате:")
-        bot.register_next_step_handler_by_chat_id(chat_id, process_payment_receipt)
-    else:
-        bot.send_message(chat_id, "⚠️ Что-то пошло не так. Пожалуйста, попробуйте снова позже.")
 
-def process_payment_receipt(message):
-    chat_id = message.chat.id
-    if message.photo:
-        # Get the largest photo size
-        photo = message.photo[-1]
-        file_id = photo.file_id
-        
-        try:
-            # Download the photo
-            file_info = bot.get_file(file_id)
-            downloaded_file = bot.download_file(file_info.file_path)
-            
-            # Send confirmation to user
-            bot.send_message(chat_id, """✅ Спасибо! Ваш чек получен. Мы проверим оплату и свяжемся с вами в течение 24 часов.
-            Есть вопросы? Напиши нам в Instagram или WhatsApp:
-            📸 @wowmotion_photo_video
-            📞 +7 (706) 651-22-93, +7 (705) 705-82-75
-            Мы на связи и рады помочь!""")
-            
-            # Notify admin about new photosession registration with photo
-            admin_chat_id = os.getenv('ADMIN_CHAT_ID')
-            if admin_chat_id:
-                try:
-                    admin_chat_id_int = int(admin_chat_id)
-                    registration_id = user_data[chat_id].get('registration_id')
-                    plan = get_plan_by_id(user_data[chat_id]['type'])
-                    
-                    # Create inline keyboard with confirmation button
-                    markup = None
-                    if registration_id:
-                        markup = types.InlineKeyboardMarkup()
-                        confirm_btn = types.InlineKeyboardButton(
-                            '✅ Подтвердить оплату', 
-                            callback_data=f'confirm_{registration_id}'
-                        )
-                        markup.add(confirm_btn)
-                    
-                    # Send registration details
-                    registration_text = f"""📸 Новая регистрация на фотосессию!
-
-👤 Имя: {user_data[chat_id]['full_name']}
-📱 Телефон: {user_data[chat_id]['phone']}
-🆔 Username: @{user_data[chat_id]['telegram_username']}
-📚 План: {plan['name']}
-💰 Стоимость: ₸{plan['price']:,}
-💳 Статус: Ожидает подтверждения оплаты
-📅 Дата регистрации: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
-                    
-                    if registration_id:
-                        registration_text += f"\n🆔 ID регистрации: {registration_id}"
-                    else:
-                        registration_text += "\n⚠️ ID регистрации: Не удалось получить (требуется ручная проверка)"
-                    
-                    # Send the payment receipt photo with confirmation button
-                    bot.send_photo(
-                        admin_chat_id_int, 
-                        downloaded_file, 
-                        caption=registration_text,
-                        reply_markup=markup
-                    )
-                    
-                except Exception as e:
-                    print(f"Error sending to admin: {e}")
-            else:
-                print("ADMIN_CHAT_ID not set in environment variables")
-                
-        except Exception as e:
-            print(f"Error processing payment receipt: {e}")
-            bot.send_message(chat_id, "⚠️ Ошибка при обработке чека. Пожалуйста, попробуйте снова.")
-    else:
-        bot.send_message(chat_id, "Пожалуйста, отправьте фото чека об оплате.")
+    try:
+        # Built before the customer is told the receipt was accepted
+        notification = receipt_notification(data)
+        if notification is None:
+            # A photo sent from the cart screen, before the order was saved
+            send_message(chat_id, CHECKOUT_FIRST_TEXT)
+            return
+        caption, markup = notification
+
+        send_message(chat_id, RECEIPT_ACCEPTED_TEXT)
+
+        # Notify all admins in the background; the customer is not kept waiting
+        admin_notifier.dispatch(
+            lambda recipient: send_receipt_to_admin(recipient, receipt, caption, markup),
+            'payment receipt'
+        )
+
+    except Exception as e:
+        print(f"Error processing payment receipt: {e}")
+        send_message(chat_id, RECEIPT_ERROR_TEXT)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
-def handle_payment_confirmation(call):
-    """Handle payment confirmation from admin"""
+# Funnel steps by the name persisted in the state store
+STEP_HANDLERS = {
+    'full_name': process_full_name,
+    'phone': process_phone,
+    'receipt': process_payment_receipt
+}
+
+def mark_receipt_confirmed(call):
+    """
+    Mark the admin's receipt message confirmed and remove its button, through
+    the outbound queue; a failed edit is only logged.
+    """
+    message_id = call.message.message_id
+    caption = confirmed_receipt_caption(call.message.caption)
+    future = outbox.submit(
+        lambda chat_id: bot.edit_message_caption(caption, chat_id, message_id, reply_markup=None),
+        call.message.chat.id,
+        priority=PRIORITY_HIGH
+    )
+
+    def report(completed):
+        error = completed.exception()
+        if error is not None:
+            print(f"Error marking receipt confirmed: {error}")
+
+    future.add_done_callback(report)
+
+def handle_payment_confirmation(call, argument):
+    """Handle payment confirmation from admin; only the first confirmation takes effect"""
     try:
-        # Extract registration ID from callback data
-        registration_id = call.data.replace('confirm_', '')
-        
-        # Update payment status in Supabase
-        success = update_photosession_payment_status(registration_id)
-        
-        if success:
-            # Get registration details to notify the user
-            registration = get_photosession_registration_by_id(registration_id)
-            
-            # Notify admin
-            bot.answer_callback_query(call.id, "✅ Платёж подтверждён и записан в базу данных.")
-            
-            # Update the message to show it's confirmed
-            bot.edit_message_caption(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                caption=call.message.caption + "\n\n✅ ПЛАТЁЖ ПОДТВЕРЖДЁН",
-                reply_markup=None  # Remove the button
-            )
-            
-            # Notify the original user
-            if registration and registration.get('telegram_id'):
-                try:
-                    user_chat_id = int(registration['telegram_id'])
-                    bot.send_message(
-                        user_chat_id, 
-                        "🎉 Ваша оплата подтверждена! Спасибо за регистрацию. Мы свяжемся с вами в ближайшее время."
-                    )
-                except Exception as e:
-                    print(f"Error notifying user: {e}")
-        else:
-            bot.answer_callback_query(call.id, "❌ Ошибка при подтверждении платежа.")
-            
+        # Mark the registration paid unless an earlier tap (this or another admin's copy) already did
+        confirmation = funnel.payment_confirmed(update_photosession_payment_status(argument))
+        acknowledge(call, confirmation.answer)
+        if confirmation.mark_confirmed:
+            mark_receipt_confirmed(call)
+        if confirmation.customer_chat_id:
+            send_message(confirmation.customer_chat_id, PAYMENT_CONFIRMED_USER_TEXT, priority=PRIORITY_HIGH)
+
     except Exception as e:
         print(f"Error in payment confirmation: {e}")
-        bot.answer_callback_query(call.id, "❌ Произошла ошибка.")
+        acknowledge(call, "❌ Произошла ошибка.")
 
-@bot.message_handler(content_types=['photo'])
 def handle_photo(message):
     chat_id = message.chat.id
-    if chat_id in user_data:
+    data = funnel.draft(chat_id)
+    if data is not None:
         # This is a payment receipt for photosession registration
-        process_payment_receipt(message)
+        process_payment_receipt(message, data)
     else:
-        bot.send_message(chat_id, "Пожалуйста, используйте команду /start для начала работы с ботом.")
+        send_message(chat_id, USE_START_TEXT)
 
 # TESTING: Command to manually trigger Google Drive sync
-@bot.message_handler(commands=['test_sync'])
 def test_sync(message):
-    bot.send_message(message.chat.id, "🔄 Starting manual Google Drive sync...")
-    sync_photosession_registrations_to_drive()
-    bot.send_message(message.chat.id, "✅ Manual sync completed!")
+    chat_id = message.chat.id
+    future, joined = drive_sync_executor.submit()
+    if joined:
+        send_message(chat_id, "⏳ A Google Drive sync is already running, waiting for it to finish...")
+    else:
+        send_message(chat_id, "🔄 Starting manual Google Drive sync...")
+
+    def report(completed):
+        try:
+            send_message(chat_id, f"✅ Manual sync completed! ({completed.result()})")
+        except Exception as e:
+            print(f"Error reporting manual sync: {e}")
+
+    # Reported from the sync thread when done; this handler returns immediately
+    future.add_done_callback(report)
+
+def reload_plans(message):
+    """Admin command: reload the plan catalog from Supabase now"""
+    chat_id = message.chat.id
+    if chat_id not in {recipient.chat_id for recipient in admin_notifier.recipients}:
+        return
+    snapshot = plan_catalog.refresh()
+    send_message(chat_id, f"✅ Plan catalog v{snapshot.version}: {len(snapshot.plans)} plans")
+
+# The same callback query delivered twice is handled once
+recent_callbacks = RecentCallbacks()
+
+def handle_callback(call):
+    """Single callback query handler: one dict lookup through the route table"""
+    # The same callback query delivered twice is handled (and written) once
+    if not recent_callbacks.first_seen(call.id):
+        print(f"Duplicate callback query {call.id} ignored: {call.data}")
+        return
+    handler, argument = callback_router.resolve(call.data)
+    if handler is None:
+        print(f"Unhandled callback: {call.data}")
+        acknowledge(call)
+        return
+    handler(call, argument)
+
+def create_app():
+    """
+    Build the bot, state store, scheduler and Drive sync plumbing.
+    The scheduler is returned unstarted; the Drive layer is only imported
+    when a sync runs (in the sync worker process by default).
+    """
+    global bot, state_store, scheduler, drive_sync_executor, drive_sync_trigger, admin_notifier, outbox, funnel, callback_router
+
+    # In webhook mode the bounded webhook queue's workers run the handlers
+    # themselves; a threaded bot would hand every update on to telebot's own
+    # unbounded worker pool and the queue would never apply backpressure
+    bot = telebot.TeleBot(TOKEN, threaded=UPDATE_MODE != 'webhook')
+    handlers = sys.modules[__name__]
+    register_handlers(bot, handlers)
+    callback_router = build_callback_router(handlers)
+
+    # Every send goes through one queue honouring Telegram's flood limits
+    outbox = OutboundQueue()
+    register_health_metric('send_queue_depth', lambda: outbox.depth)
+
+    # Draft registration and pending funnel step per chat (bounded, TTL-evicted,
+    # persisted across restarts with the sqlite backend)
+    state_store = create_state_store()
+
+    # Admin chats/topics notified about new receipts (ADMIN_CHAT_IDS or ADMIN_CHAT_ID)
+    admin_notifier = NotificationDispatcher(get_admin_recipients(), name='admin-notify')
+
+    drive_sync_executor = create_drive_sync_executor()
+    drive_sync_trigger = create_drive_sync_trigger(drive_sync_executor)
+
+    scheduler = BackgroundScheduler(timezone=timezone.utc)
+    add_scheduled_jobs(scheduler, drive_sync_executor.run, state_store)
+
+    # Step transitions and cart/order decisions shared with the other engine
+    funnel = Funnel(state_store, drive_sync_trigger)
+    return bot, scheduler
+
+def process_webhook_update(json_string):
+    """Parse a raw webhook update and dispatch it to the handlers"""
+    update = telebot.types.Update.de_json(json_string)
+    bot.process_new_updates([update])
+
+def run_webhook():
+    """Serve updates through the health_check Flask app instead of long polling"""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET are required for webhook mode")
+
+    enable_webhook(process_webhook_update, WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+    health_thread = start_health_server()
+
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"✅ Webhook set, receiving updates on {WEBHOOK_PATH}")
+    record_startup_time(STARTUP_STARTED_AT)
+    health_thread.join()
 
 if __name__ == "__main__":
-    print("Bot is polling...")
-    print(f"Google Drive sync scheduled every {SYNC_INTERVAL_MINUTES} minutes")
-    
-    # Start health check server for Railway
-    try:
-        start_health_server()
-        print("✅ Health check server started")
-    except Exception as e:
-        print(f"⚠️ Health check server failed to start: {e}")
-    
-    bot.polling(none_stop=True)
+    if BOT_MODE == 'async':
+        import asyncio
+        import async_bot
+        asyncio.run(async_bot.main(STARTUP_STARTED_AT))
+    else:
+        create_app()
+        print_drive_sync_settings()
+        scheduler.start()
+
+        if UPDATE_MODE == 'webhook':
+            run_webhook()
+        else:
+            print("Bot is polling...")
+
+            # Start health check server for Railway
+            try:
+                start_health_server()
+                print("✅ Health check server started")
+            except Exception as e:
+                print(f"⚠️ Health check server failed to start: {e}")
+
+            # Drop a webhook left over from a previous webhook deployment
+            bot.remove_webhook()
+            record_startup_time(STARTUP_STARTED_AT)
+            bot.polling(none_stop=True)
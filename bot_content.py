@@ -0,0 +1,198 @@
+import re
+from datetime import datetime
+from telebot import types
+
+# Texts, keyboards and input validation shared by the sync (bot.py) and
+# async (async_bot.py) front ends, so both modes run the same funnel.
+
+WELCOME_TEXT = """👋 Добро пожаловать!
+        Я ваш помощник по бронированию фотосессий. 
+        Выберите, что хотите сделать:"""
+
+# The price list itself is rendered from the plan catalog by prices_text()
+PRICES_TITLE_TEXT = "📸 Пакеты фотосъёмки в парящих платьях — Астана"
+PRICES_EXTRAS_TITLE_TEXT = "🎯 Дополнительные услуги (по желанию)"
+# Extras quoted per shoot and not sold through the bot
+PRICES_EXTRA_NOTES = ("Реквизит (диадема, шары, дым, лепестки и т.п.): ₸10 000 – ₸30 000",)
+PRICES_SEPARATOR = "⸻"
+
+CHOOSE_SESSION_TEXT = "Выберите, какую фотосессию вы хотите заказать:"
+CHOOSE_EXTRA_TEXT = "Выберите, что вы хотите заказать:"
+PLAN_NOT_FOUND_TEXT = "❌ План не найден. Пожалуйста, попробуйте снова."
+ASK_FULL_NAME_TEXT = "Для регистрации на фотосессию, пожалуйста, напишите ваше полное имя:"
+ASK_PHONE_TEXT = "Пожалуйста, напишите свой номер телефона:"
+INVALID_PHONE_TEXT = "🚫 Пожалуйста, введите корректный номер телефона (пример: +77011234567)"
+REGISTRATION_SUCCESS_TEXT = "✅ Регистрация на фотосессию прошла успешно!"
+REGISTRATION_FAILED_TEXT = "⚠️ Что-то пошло не так. Пожалуйста, попробуйте снова позже."
+SEND_RECEIPT_TEXT = "📸 Отправьте фото или PDF чека об оплате:"
+RECEIPT_REQUIRED_TEXT = "Пожалуйста, отправьте фото или PDF чека об оплате."
+RECEIPT_ERROR_TEXT = "⚠️ Ошибка при обработке чека. Пожалуйста, попробуйте снова."
+PAYMENT_CONFIRMED_USER_TEXT = "🎉 Ваша оплата подтверждена! Спасибо за регистрацию. Мы свяжемся с вами в ближайшее время."
+PAYMENT_CONFIRMED_ADMIN_TEXT = "✅ Платёж подтверждён и записан в базу данных."
+PAYMENT_ALREADY_CONFIRMED_TEXT = "ℹ️ Этот платёж уже подтверждён."
+PAYMENT_CONFIRMATION_FAILED_TEXT = "❌ Ошибка при подтверждении платежа."
+# Appended to the caption of a confirmed receipt in the admin chats
+RECEIPT_CONFIRMED_MARK = "✅ ПЛАТЁЖ ПОДТВЕРЖДЁН"
+USE_START_TEXT = "Пожалуйста, используйте команду /start для начала работы с ботом."
+CART_PROMPT_TEXT = "Добавьте дополнительные услуги или оформите заказ:"
+CHECKOUT_FIRST_TEXT = "Сначала оформите заказ: нажмите «✅ Оформить заказ» и укажите имя и телефон, затем отправьте чек об оплате."
+
+RECEIPT_ACCEPTED_TEXT = """✅ Спасибо! Ваш чек получен. Мы проверим оплату и свяжемся с вами в течение 24 часов.
+            Есть вопросы? Напиши нам в Instagram или WhatsApp:
+            📸 @wowmotion_photo_video
+            📞 +7 (706) 651-22-93, +7 (705) 705-82-75
+            Мы на связи и рады помочь!"""
+
+def validate_phone_number(phone):
+    """
+    Validate Kazakhstan phone number format.
+    Accepts: +7 707 123 45 67, 87071234567, 8 (707) 123-45-67, +77071234567
+    """
+    # Remove all non-digit characters except +
+    cleaned = re.sub(r'[^\d+]', '', phone)
+    
+    # Check for valid Kazakhstan mobile number patterns
+    patterns = [
+        r'^\+77\d{9}$',  # +77071234567
+        r'^87\d{9}$',    # 87071234567
+    ]
+    
+    for pattern in patterns:
+        if re.match(pattern, cleaned):
+            return True
+    
+    return False
+
+def format_phone_number(phone):
+    """
+    Format phone number to standard Kazakhstan format: +7 7XX XXX XX XX
+    """
+    # Remove all non-digit characters
+    cleaned = re.sub(r'[^\d]', '', phone)
+    
+    # If it starts with 8, replace with +7
+    if cleaned.startswith('8'):
+        cleaned = '7' + cleaned[1:]
+    
+    # If it doesn't start with 7, add +7
+    if not cleaned.startswith('7'):
+        cleaned = '7' + cleaned
+    
+    # Format as +7 7XX XXX XX XX
+    if len(cleaned) == 11 and cleaned.startswith('7'):
+        return f"+7 {cleaned[1:4]} {cleaned[4:7]} {cleaned[7:9]} {cleaned[9:11]}"
+    
+    return phone  # Return original if can't format
+
+def resolve_plan_id(plan_ref):
+    """Map the argument of a buy_ callback to a plan ID (duo/trio use *_plan callbacks)"""
+    plan_id = plan_ref
+    
+    # Handle special cases for duo and trio
+    if plan_id == 'duo_plan':
+        plan_id = 'duo'
+    elif plan_id == 'trio_plan':
+        plan_id = 'trio'
+    return plan_id
+
+def admin_confirm_markup(registration_id):
+    """Inline keyboard with the admin's payment confirmation button"""
+    markup = types.InlineKeyboardMarkup()
+    confirm_btn = types.InlineKeyboardButton(
+        '✅ Подтвердить оплату', 
+        callback_data=f'confirm_{registration_id}'
+    )
+    markup.add(confirm_btn)
+    return markup
+
+def format_price(price):
+    """₸200 000 style price used in the price list"""
+    return f"₸{price:,}".replace(',', ' ')
+
+def prices_text(plans):
+    """
+    Price list for the 'see_prices' menu, rendered from the plan catalog:
+    one section per package with its 'features', then the extras.
+    """
+    sections = [PRICES_TITLE_TEXT]
+    extras = []
+    for plan in plans.values():
+        label = plan.get('button') or plan['name']
+        if plan.get('category') == 'extra':
+            price = format_price(plan['price'])
+            if plan.get('price_note'):
+                price = f"{price} {plan['price_note']}"
+            extras.append(f"{label}: {price}")
+            continue
+
+        lines = [f"{label} — {format_price(plan['price'])}"]
+        if plan.get('features'):
+            lines += ['', 'Включено:'] + [f"• {feature}" for feature in plan['features']]
+        sections.append('\n'.join(lines))
+
+    extras += PRICES_EXTRA_NOTES
+    if extras:
+        sections.append(PRICES_EXTRAS_TITLE_TEXT + '\n\n' + '\n'.join(f"• {extra}" for extra in extras))
+    return f"\n\n{PRICES_SEPARATOR}\n\n".join(sections)
+
+def plan_details_text(plan):
+    return f"""💰 Полная стоимость: ₸{plan['price']:,}
+📋 {plan['description']}
+
+💵 Оплата на Kaspi / переводом  
+📍 Место бронируется после оплаты
+
+Есть вопросы? Напиши нам в Instagram или WhatsApp:
+📸 @wowmotion_photo_video
+📞 +7 (706) 651-22-93, +7 (705) 705-82-75
+Мы на связи и рады помочь!"""
+
+def order_lines_text(lines):
+    """One bullet per order line: name, quantity and line total"""
+    return '\n'.join(
+        f"• {line.name}" + (f" × {line.quantity}" if line.quantity > 1 else '')
+        + f" — {format_price(line.unit_price * line.quantity)}"
+        for line in lines
+    )
+
+def cart_text(lines, total):
+    return f"""🧾 Ваш заказ:
+{order_lines_text(lines)}
+
+💰 Итого: {format_price(total)}
+
+{CART_PROMPT_TEXT}"""
+
+def payment_instructions_text(plan, total=None):
+    """Payment instructions for a plan, or for a whole order when its total is given"""
+    return f"""💳 ИНСТРУКЦИИ ПО ОПЛАТЕ
+
+💰 Стоимость: ₸{plan['price'] if total is None else total:,}
+
+📱 Оплата через Kaspi:
+• Ссылка: https://pay.kaspi.kz/pay/s6llvgtb
+• Получатель: WowMotion
+• Назначение: Фотосессия {plan['name']}
+
+📸 После оплаты, пожалуйста, отправьте фото чека для подтверждения."""
+
+def admin_registration_text(registration_data, plan, registration_id, lines=None, total=None):
+    """Caption for the admin's receipt notification; lists the order lines when given"""
+    if lines:
+        order = f"🧾 Заказ:\n{order_lines_text(lines)}\n💰 Итого: {format_price(total)}"
+    else:
+        order = f"📚 План: {plan['name']}\n💰 Стоимость: ₸{plan['price']:,}"
+    text = f"""📸 Новая регистрация на фотосессию!
+
+👤 Имя: {registration_data['full_name']}
+📱 Телефон: {registration_data['phone']}
+🆔 Username: @{registration_data['telegram_username']}
+{order}
+💳 Статус: Ожидает подтверждения оплаты
+📅 Дата регистрации: {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
+    
+    if registration_id:
+        text += f"\n🆔 ID регистрации: {registration_id}"
+    else:
+        text += "\n⚠️ ID регистрации: Не удалось получить (требуется ручная проверка)"
+    return text
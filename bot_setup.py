@@ -0,0 +1,137 @@
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from supabase_utils import plan_catalog
+from callback_router import CallbackRouter
+from menus import MENU_TREE
+from sync_trigger import DebouncedTrigger, SingleFlightExecutor
+from sync_worker import SyncWorkerProcess
+from health_check import register_health_metric
+
+# Settings and wiring shared by the sync (bot.py) and async (async_bot.py)
+# engines: callback routes, handler registration, the Drive sync plumbing and
+# the scheduled jobs. Each engine passes in its own module of handlers (same
+# names in both) and its own scheduler.
+
+# Load environment variables from .env file
+load_dotenv()
+TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+
+# Update ingestion: 'polling' (default) or 'webhook' (served by the
+# health_check Flask app; sync engine only)
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling').lower()
+
+# Easily editable sync interval (in minutes)
+SYNC_INTERVAL_MINUTES = 6 * 60
+
+# How often expired conversation drafts are dropped from the state store
+STATE_PURGE_INTERVAL_MINUTES = int(os.getenv('STATE_PURGE_INTERVAL_MINUTES', 60))
+
+# Event-driven Drive sync: bot events (new registration, confirmed payment)
+# trigger a sync after DRIVE_SYNC_DEBOUNCE_SECONDS of quiet, at most
+# DRIVE_SYNC_MAX_STALENESS_SECONDS after the first event. The periodic job
+# above is only a safety net.
+DRIVE_SYNC_DEBOUNCE_SECONDS = int(os.getenv('DRIVE_SYNC_DEBOUNCE_SECONDS', 60))
+DRIVE_SYNC_MAX_STALENESS_SECONDS = int(os.getenv('DRIVE_SYNC_MAX_STALENESS_SECONDS', 300))
+
+# Where the Drive export runs: 'process' (child worker process, default) or 'thread'
+DRIVE_SYNC_WORKER = os.getenv('DRIVE_SYNC_WORKER', 'process').lower()
+
+# Menu taps: 'edit' the tapped message in place (default) or 'send' a new one
+MENU_NAVIGATION = os.getenv('MENU_NAVIGATION', 'edit').lower()
+
+# Callback routes by the action before the first '_' (plan_<id>, buy_<plan>,
+# pay_<plan>, add_<plan>, remove_<plan>, confirm_<id>), by handler name
+CALLBACK_ROUTES = {
+    'plan': 'handle_menu',
+    'add': 'handle_cart_add',
+    'remove': 'handle_cart_remove',
+    'checkout': 'handle_checkout',
+    'buy': 'handle_plan_selection',
+    'pay': 'handle_payment_initiation',
+    'confirm': 'handle_payment_confirmation'
+}
+
+def build_callback_router(handlers):
+    """
+    Route table over the handlers of an engine module. Each menu of the tree
+    is routed straight to handle_menu; plan nodes go through the 'plan'
+    route, so plans added to the catalog need no new route.
+    """
+    router = CallbackRouter({action: getattr(handlers, name) for action, name in CALLBACK_ROUTES.items()})
+    for key in MENU_TREE:
+        router.add(key, handlers.handle_menu)
+    return router
+
+def register_handlers(bot, handlers):
+    """Attach an engine's handlers to bot; the pending funnel step is checked first"""
+    bot.register_message_handler(handlers.handle_next_step, func=handlers.has_pending_step, content_types=['text', 'photo', 'document'])
+    bot.register_message_handler(handlers.send_welcome, commands=['start'])
+    bot.register_message_handler(handlers.test_sync, commands=['test_sync'])
+    bot.register_message_handler(handlers.reload_plans, commands=['reload_plans'])
+    bot.register_message_handler(handlers.handle_photo, content_types=['photo', 'document'])
+    bot.register_callback_query_handler(handlers.handle_callback, func=lambda call: True)
+
+def run_drive_sync_in_thread():
+    """Run the Drive sync in this process, loading the Drive layer on first use"""
+    from drive_sync import sync_photosession_registrations_to_drive
+    return sync_photosession_registrations_to_drive()
+
+def create_drive_sync_executor():
+    """
+    All Drive syncs (scheduled, event-driven, manual) run on the executor's
+    thread, off the bot threads and event loop, one at a time; overlapping
+    requests join the run in progress.
+    """
+    if DRIVE_SYNC_WORKER == 'process':
+        return SingleFlightExecutor(SyncWorkerProcess().run_drive_sync, name='drive-sync')
+    return SingleFlightExecutor(run_drive_sync_in_thread, name='drive-sync')
+
+def create_drive_sync_trigger(drive_sync_executor):
+    """Debounced Drive sync for bot events; fires on a timer thread"""
+    return DebouncedTrigger(
+        drive_sync_executor.submit,
+        debounce_seconds=DRIVE_SYNC_DEBOUNCE_SECONDS,
+        max_delay_seconds=DRIVE_SYNC_MAX_STALENESS_SECONDS,
+        name='Google Drive sync'
+    )
+
+def add_scheduled_jobs(scheduler, run_drive_sync, state_store):
+    """
+    Add the periodic jobs to an engine's (unstarted) scheduler; run_drive_sync
+    is the engine's safety-net Drive sync job.
+    """
+    # Google Drive sync every SYNC_INTERVAL_MINUTES
+    scheduler.add_job(
+        run_drive_sync,
+        'interval',
+        minutes=SYNC_INTERVAL_MINUTES,
+        coalesce=True,
+        max_instances=1
+    )
+
+    # Reload the plan catalog every PLAN_CATALOG_TTL_SECONDS, the first time as
+    # soon as the scheduler starts; the built-in plans are served until then
+    scheduler.add_job(
+        plan_catalog.refresh,
+        'interval',
+        seconds=plan_catalog.ttl_seconds,
+        next_run_time=datetime.now(timezone.utc),
+        coalesce=True,
+        max_instances=1
+    )
+    register_health_metric('plan_catalog_version', lambda: plan_catalog.snapshot.version)
+
+    # Drop expired drafts of chats that never came back; reads only skip them
+    scheduler.add_job(
+        state_store.purge_expired,
+        'interval',
+        minutes=STATE_PURGE_INTERVAL_MINUTES,
+        coalesce=True,
+        max_instances=1
+    )
+
+def print_drive_sync_settings():
+    print(f"Google Drive sync on bot events (debounce {DRIVE_SYNC_DEBOUNCE_SECONDS}s, "
+          f"max staleness {DRIVE_SYNC_MAX_STALENESS_SECONDS}s), safety net every {SYNC_INTERVAL_MINUTES} minutes")
+    print(f"Google Drive export runs in a {DRIVE_SYNC_WORKER} worker")
@@ -0,0 +1,60 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Callback query dispatch through a single registered handler and a route
+# table, instead of one handler per button with lambda filters evaluated in
+# order for every callback.
+
+class CallbackRouter:
+    """
+    Route table for callback queries. callback_data is parsed once into
+    (action, argument): the whole string when it is a route of its own
+    (static menu buttons such as 'buy_session'), otherwise
+    '<action>_<argument>' (e.g. 'pay_solo1', 'confirm_<id>').
+    Both lookups are a dict access, however many routes there are.
+    """
+
+    def __init__(self, routes=None):
+        self._routes = dict(routes or {})
+
+    def add(self, action, handler):
+        self._routes[action] = handler
+
+    def parse(self, data):
+        """Split callback_data into (action, argument); argument is None for static routes"""
+        if data in self._routes:
+            return data, None
+        action, separator, argument = data.partition('_')
+        return action, argument if separator else None
+
+    def resolve(self, data):
+        """Return (handler, argument) for callback_data, handler is None if unrouted"""
+        action, argument = self.parse(data or '')
+        return self._routes.get(action), argument
+
+class RecentCallbacks:
+    """
+    Callback query ids seen in the last ttl_seconds (at most max_entries), so
+    a callback delivered more than once (webhook redeliveries, overlapping
+    pollers after a restart) is only handled the first time.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._seen = OrderedDict()  # callback query id -> expires_at, oldest first
+        self._lock = threading.Lock()
+
+    def first_seen(self, callback_id):
+        """Record callback_id; True the first time it is seen, False for a duplicate"""
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) < now:
+                self._seen.popitem(last=False)
+            if callback_id in self._seen:
+                return False
+            self._seen[callback_id] = now + self.ttl_seconds
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return True
@@ -8,9 +8,31 @@ CREATE TABLE IF NOT EXISTS photosession_registrations (
     plan_id TEXT NOT NULL,
     plan_name TEXT NOT NULL,
     is_paid BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Add updated_at to tables created before it existed (used as the Drive sync watermark)
+ALTER TABLE photosession_registrations
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+-- Keep updated_at current on every insert and update. clock_timestamp() is
+-- the time of the write, not the start of its transaction (NOW()), so a
+-- long transaction can't commit a row stamped well before rows the Drive
+-- sync has already read; the sync re-reads an overlap for the remainder.
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_photosession_registrations_updated_at ON photosession_registrations;
+CREATE TRIGGER trg_photosession_registrations_updated_at
+    BEFORE INSERT OR UPDATE ON photosession_registrations
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
 -- Create index for faster queries by telegram_id
 CREATE INDEX IF NOT EXISTS idx_photosession_registrations_telegram_id 
 ON photosession_registrations(telegram_id);
@@ -23,13 +45,280 @@ ON photosession_registrations(is_paid);
 CREATE INDEX IF NOT EXISTS idx_photosession_registrations_created_at 
 ON photosession_registrations(created_at);
 
+-- Create index for incremental sync queries by modification date
+CREATE INDEX IF NOT EXISTS idx_photosession_registrations_updated_at 
+ON photosession_registrations(updated_at);
+
+-- Key/value state for background jobs (e.g. the Drive sync watermark)
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Plan catalog, loaded by the bot into an in-memory snapshot and reloaded
+-- every PLAN_CATALOG_TTL_SECONDS (or with /reload_plans), so prices and plans
+-- change without a redeploy. Set is_active = false to hide a plan.
+CREATE TABLE IF NOT EXISTS photosession_plans (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL CHECK (price >= 0),
+    description TEXT NOT NULL,
+    category TEXT NOT NULL,                 -- menu the plan is listed in: solo, duo, trio or extra
+    button TEXT NOT NULL,                   -- button label in that menu
+    features TEXT[],                        -- bullets of the price list
+    price_note TEXT,                        -- suffix to the price in the price list
+    sort_order INTEGER NOT NULL DEFAULT 0,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+DROP TRIGGER IF EXISTS trg_photosession_plans_updated_at ON photosession_plans;
+CREATE TRIGGER trg_photosession_plans_updated_at
+    BEFORE INSERT OR UPDATE ON photosession_plans
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Seed with the bot's built-in plans; existing rows are left untouched
+INSERT INTO photosession_plans (id, name, price, description, category, button, features, price_note, sort_order)
+VALUES
+    ('solo1', 'Solo Базовый', 200000, '1 парящее платье, макияж и прическа, все снимки без обработки, 5 обработанных фотографий', 'solo', '💫 Solo Базовый', ARRAY[
+        '1 парящее платье',
+        'Макияж и прическа',
+        'Все снимки без обработки (в течение 3-4 дней после съемки)',
+        '5 обработанных фотографий (в течение 4 недель после съемки)',
+        'Ассистент (входит во все пакеты - помогает надевать платье, подгоняет под фигуру, работает с подолом и образом во время съемки)'
+    ], NULL, 10),
+    ('solo2', 'Premium Solo', 280000, '1 парящее платье, макияж и причёска, все снимки без обработки, 12 обработанных фото', 'solo', '👑 Premium Solo', ARRAY[
+        '1 парящее платье',
+        'Макияж и причёска',
+        'Все снимки без обработки (в течение 3-4 дней после съемки)',
+        '12 обработанных фото (приоритетная обработка, в течение 10 дней после съемки)',
+        'Ассистент (входит во все пакеты - полный функционал)'
+    ], NULL, 20),
+    ('solo3', 'VIP', 360000, '2 парящих платья, макияж и причёска, все снимки без обработки, 25 обработанных фото', 'solo', '🥇VIP', ARRAY[
+        '2 парящих платья (смена образа во время съемки)',
+        'Макияж и причёска',
+        'Все снимки без обработки (в течение 3-4 дней после съемки)',
+        '25 обработанных фото (в течение 4 недель)',
+        'Приоритетная дата съемки',
+        'Ассистент (входит во все пакеты - полный функционал)'
+    ], NULL, 30),
+    ('duo', 'Два поколения', 360000, '1 парящее платье на каждую участницу, макияж и прическа для обеих, 15 обработанных фото', 'duo', '👩‍👧 Два поколения', ARRAY[
+        '1 парящее платье на каждую участницу',
+        'Макияж и прическа для обеих',
+        'Все снимки без обработки (в течение 3–4 дней после съемки)',
+        '15 обработанных фото (в течение 4 недель)',
+        'Ассистент (помощь с образами, подолом, позированием)'
+    ], NULL, 40),
+    ('trio', 'Три поколения', 440000, '1 парящее платье на каждую участницу, макияж и прическа для трёх, 20 обработанных фото', 'trio', '👩‍👧‍👵 Три поколения', ARRAY[
+        '1 парящее платье на каждую участницу',
+        'Макияж и прическа для трёх',
+        'Все снимки без обработки (в течение 3–4 дней после съемки)',
+        '20 обработанных фото (в течение 4 недель)',
+        'Ассистент (работает с каждой участницей)'
+    ], NULL, 50),
+    ('extra1', 'Видео Reels', 70000, 'Короткое видео (15–30 сек)', 'extra', 'Видео Reels / короткое видео (15–30 сек)', NULL, NULL, 60),
+    ('extra2', 'Дополнительное платье', 25000, 'Дополнительное парящее платье', 'extra', 'Дополнительное платье', NULL, NULL, 70),
+    ('extra3', 'Дополнительное фото', 5000, 'Дополнительное обработанное фото', 'extra', 'Дополнительное обработанное фото', NULL, 'за 1 шт.', 80)
+ON CONFLICT (id) DO NOTHING;
+
+-- Orders: one per checkout, for the registration it was placed with, with
+-- one order_items row per plan/extra and quantity
+CREATE TABLE IF NOT EXISTS orders (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    registration_id UUID NOT NULL REFERENCES photosession_registrations(id) ON DELETE CASCADE,
+    telegram_id TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id BIGSERIAL PRIMARY KEY,
+    order_id UUID NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    plan_id TEXT NOT NULL REFERENCES photosession_plans(id),
+    plan_name TEXT NOT NULL,
+    unit_price INTEGER NOT NULL,
+    quantity INTEGER NOT NULL CHECK (quantity BETWEEN 1 AND 100)
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_registration_id ON orders(registration_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id);
+
+-- Pending registrations of a customer for a plan (register_photosession lookup)
+CREATE INDEX IF NOT EXISTS idx_photosession_registrations_pending
+ON photosession_registrations(telegram_id, plan_id, created_at) WHERE NOT is_paid;
+
+-- Insert a registration, or reuse the customer's unpaid registration for the
+-- same plan, with the same name and phone, made within reuse_window_minutes
+-- that has no order yet (a double tap or a repeated call before the order
+-- was written). A registration with an order is never reused, so a second
+-- purchase of the same plan always gets its own row. Calls for one
+-- telegram_id and plan_id are serialized, so concurrent duplicates get the
+-- same row. Returns the registration id.
+-- Called as POST /rest/v1/rpc/register_photosession.
+CREATE OR REPLACE FUNCTION register_photosession(registration JSONB, reuse_window_minutes INTEGER DEFAULT 30)
+RETURNS UUID AS $$
+DECLARE
+    found_id UUID;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext((registration->>'telegram_id') || ':' || (registration->>'plan_id')));
+
+    SELECT r.id INTO found_id
+    FROM photosession_registrations r
+    WHERE r.telegram_id = registration->>'telegram_id'
+      AND r.plan_id = registration->>'plan_id'
+      AND r.full_name = registration->>'full_name'
+      AND r.phone_number = registration->>'phone_number'
+      AND NOT r.is_paid
+      AND r.created_at > NOW() - make_interval(mins => reuse_window_minutes)
+      AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.registration_id = r.id)
+    ORDER BY r.created_at DESC
+    LIMIT 1;
+
+    IF found_id IS NULL THEN
+        INSERT INTO photosession_registrations (full_name, phone_number, telegram_username, telegram_id, plan_id, plan_name)
+        VALUES (
+            registration->>'full_name',
+            registration->>'phone_number',
+            registration->>'telegram_username',
+            registration->>'telegram_id',
+            registration->>'plan_id',
+            registration->>'plan_name'
+        )
+        RETURNING id INTO found_id;
+    ELSE
+        UPDATE photosession_registrations
+        SET telegram_username = registration->>'telegram_username'
+        WHERE id = found_id;
+    END IF;
+
+    RETURN found_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- An order as returned by create_photosession_order
+CREATE OR REPLACE FUNCTION photosession_order_json(order_id UUID)
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'registration_id', o.registration_id,
+        'order_id', o.id,
+        'total', o.total,
+        'items', (
+            SELECT jsonb_agg(jsonb_build_object(
+                'plan_id', i.plan_id,
+                'name', i.plan_name,
+                'unit_price', i.unit_price,
+                'quantity', i.quantity
+            ) ORDER BY i.id)
+            FROM order_items i
+            WHERE i.order_id = o.id
+        )
+    )
+    FROM orders o
+    WHERE o.id = photosession_order_json.order_id;
+$$ LANGUAGE sql STABLE;
+
+-- Write a checkout in one call and one transaction: the registration, its
+-- order and the line items. items is [{"plan_id": ..., "quantity": ...}];
+-- prices and the total come from photosession_plans, never from the client.
+-- The same checkout repeated within reuse_window_minutes (same plan, name,
+-- phone and items, still unpaid; e.g. a resent phone number) returns the
+-- order already written instead of a second one. Orders are never replaced
+-- or deleted: any other checkout gets a new registration and order.
+-- Called by the bot as POST /rest/v1/rpc/create_photosession_order.
+DROP FUNCTION IF EXISTS create_photosession_order(JSONB, JSONB);
+CREATE OR REPLACE FUNCTION create_photosession_order(registration JSONB, items JSONB, reuse_window_minutes INTEGER DEFAULT 30)
+RETURNS JSONB AS $$
+DECLARE
+    new_registration_id UUID;
+    new_order_id UUID;
+    item_count INTEGER;
+    order_total INTEGER;
+BEGIN
+    -- Same lock as register_photosession, so concurrent duplicates see each other's order
+    PERFORM pg_advisory_xact_lock(hashtext((registration->>'telegram_id') || ':' || (registration->>'plan_id')));
+
+    SELECT o.id INTO new_order_id
+    FROM photosession_registrations r
+    JOIN orders o ON o.registration_id = r.id
+    WHERE r.telegram_id = registration->>'telegram_id'
+      AND r.plan_id = registration->>'plan_id'
+      AND r.full_name = registration->>'full_name'
+      AND r.phone_number = registration->>'phone_number'
+      AND NOT r.is_paid
+      AND r.created_at > NOW() - make_interval(mins => reuse_window_minutes)
+      AND (
+          SELECT jsonb_agg(jsonb_build_array(i.plan_id, i.quantity) ORDER BY i.plan_id)
+          FROM order_items i
+          WHERE i.order_id = o.id
+      ) = (
+          SELECT jsonb_agg(jsonb_build_array(item.plan_id, item.quantity) ORDER BY item.plan_id)
+          FROM jsonb_to_recordset(items) AS item(plan_id TEXT, quantity INTEGER)
+      )
+    ORDER BY o.created_at DESC
+    LIMIT 1;
+
+    IF new_order_id IS NOT NULL THEN
+        RETURN photosession_order_json(new_order_id);
+    END IF;
+
+    new_registration_id := register_photosession(registration, reuse_window_minutes);
+
+    INSERT INTO orders (registration_id, telegram_id)
+    VALUES (new_registration_id, registration->>'telegram_id')
+    RETURNING id INTO new_order_id;
+
+    INSERT INTO order_items (order_id, plan_id, plan_name, unit_price, quantity)
+    SELECT new_order_id, p.id, p.name, p.price, item.quantity
+    FROM ROWS FROM (jsonb_to_recordset(items) AS (plan_id TEXT, quantity INTEGER))
+        WITH ORDINALITY AS item(plan_id, quantity, item_position)
+    JOIN photosession_plans p ON p.id = item.plan_id AND p.is_active
+    ORDER BY item.item_position;
+
+    GET DIAGNOSTICS item_count = ROW_COUNT;
+    IF item_count = 0 OR item_count <> jsonb_array_length(items) THEN
+        RAISE EXCEPTION 'Order contains unknown or inactive plans: %', items;
+    END IF;
+
+    SELECT SUM(unit_price * quantity) INTO order_total FROM order_items WHERE order_id = new_order_id;
+    UPDATE orders SET total = order_total WHERE id = new_order_id;
+
+    RETURN photosession_order_json(new_order_id);
+END;
+$$ LANGUAGE plpgsql;
+
 -- Enable Row Level Security (RLS) for better security
 ALTER TABLE photosession_registrations ENABLE ROW LEVEL SECURITY;
 
 -- Create policy to allow all operations (you can modify this based on your security needs)
+DROP POLICY IF EXISTS "Allow all operations on photosession_registrations" ON photosession_registrations;
 CREATE POLICY "Allow all operations on photosession_registrations" ON photosession_registrations
     FOR ALL USING (true);
 
+ALTER TABLE sync_state ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all operations on sync_state" ON sync_state;
+CREATE POLICY "Allow all operations on sync_state" ON sync_state
+    FOR ALL USING (true);
+
+ALTER TABLE photosession_plans ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all operations on photosession_plans" ON photosession_plans;
+CREATE POLICY "Allow all operations on photosession_plans" ON photosession_plans
+    FOR ALL USING (true);
+
+ALTER TABLE orders ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all operations on orders" ON orders;
+CREATE POLICY "Allow all operations on orders" ON orders
+    FOR ALL USING (true);
+
+ALTER TABLE order_items ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow all operations on order_items" ON order_items;
+CREATE POLICY "Allow all operations on order_items" ON order_items
+    FOR ALL USING (true);
+
 -- Optional: Create a view for easy querying of paid registrations
 CREATE OR REPLACE VIEW paid_photosession_registrations AS
 SELECT 
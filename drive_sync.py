@@ -0,0 +1,485 @@
+import os
+import io
+import csv
+import json
+import itertools
+import tempfile
+import threading
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+import openpyxl
+from openpyxl.utils import get_column_letter
+from supabase_utils import (
+    fetch_photosession_registrations_changed_since,
+    get_photosession_registrations_fingerprint,
+    get_sync_states,
+    set_sync_state
+)
+
+# Google Drive / Sheets export of photosession registrations. Kept out of
+# supabase_utils so the bot only loads the Google client libraries and
+# openpyxl when a sync actually runs (in the sync worker by default).
+
+# Drive file synced with photosession registrations
+DRIVE_FILE_NAME = 'PhotosessionRegistrations.xlsx'
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+GOOGLE_SHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+# Chunk size for resumable uploads of exported files (multiple of 256 KB)
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+# sync_state key holding the fingerprint of the registrations at the last successful sync
+DRIVE_SYNC_FINGERPRINT_KEY = 'drive_sync_fingerprint'
+
+# Drive sync outcomes since process start
+drive_sync_stats = {'performed': 0, 'skipped': 0, 'failed': 0}
+
+# sync_state key holding the updated_at of the last registration synced to Drive
+DRIVE_SYNC_WATERMARK_KEY = 'drive_sync_watermark'
+# Each sync re-reads registrations changed this long before the watermark, to
+# catch rows committed after a later-stamped row was synced (both writers
+# upsert by id, so re-applied rows are harmless)
+DRIVE_SYNC_WATERMARK_OVERLAP_SECONDS = int(os.getenv('DRIVE_SYNC_WATERMARK_OVERLAP_SECONDS', 300))
+
+def get_service_account_credentials():
+    """
+    Get Google service account credentials from environment variable.
+    Returns credentials object for Google APIs.
+    """
+    service_account_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
+    if not service_account_json:
+        raise ValueError("GOOGLE_SERVICE_ACCOUNT_JSON not found in environment variables")
+    
+    try:
+        # Parse the JSON string from environment variable
+        service_account_info = json.loads(service_account_json)
+        return service_account.Credentials.from_service_account_info(service_account_info)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_JSON: {e}")
+
+def find_file_metadata(service, folder_id, file_name):
+    """Find file metadata in Google Drive folder"""
+    query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+    results = service.files().list(q=query, fields="files(id, name, mimeType)").execute()
+    files = results.get('files', [])
+    if not files:
+        raise FileNotFoundError(f"File '{file_name}' not found in folder '{folder_id}'")
+    return files[0]  # returns dict with id, name, mimeType
+
+class DriveClient:
+    """
+    Long-lived Google Drive client shared by all sync runs.
+    Caches the service account credentials (the authorized transport refreshes
+    the access token only when it expires), the built Drive service, the
+    resolved file metadata and the last workbook uploaded by this process.
+    """
+
+    def __init__(self):
+        self._credentials = None
+        self._service = None
+        self._sheets_service = None
+        self._files = {}  # (folder_id, file_name) -> {'id', 'name', 'mimeType'}
+        self._workbooks = {}  # file_id -> (Drive version, xlsx bytes)
+        self._lock = threading.Lock()
+
+    @property
+    def credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = get_service_account_credentials()
+            return self._credentials
+
+    @property
+    def service(self):
+        if self._service is None:
+            creds = self.credentials
+            with self._lock:
+                if self._service is None:
+                    self._service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        return self._service
+
+    @property
+    def sheets_service(self):
+        """Google Sheets API service, built on the same cached credentials"""
+        if self._sheets_service is None:
+            creds = self.credentials
+            with self._lock:
+                if self._sheets_service is None:
+                    self._sheets_service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
+        return self._sheets_service
+
+    def get_file_version(self, file_id):
+        return self.service.files().get(fileId=file_id, fields='version').execute().get('version')
+
+    def get_file_metadata(self, folder_id, file_name):
+        """Resolve a file in a folder once and reuse the id/mimeType afterwards"""
+        key = (folder_id, file_name)
+        if key not in self._files:
+            self._files[key] = find_file_metadata(self.service, folder_id, file_name)
+        return self._files[key]
+
+    def remember_file(self, folder_id, file_name, metadata):
+        self._files[(folder_id, file_name)] = metadata
+
+    def invalidate_file(self, folder_id, file_name):
+        """
+        Forget a resolved file, e.g. after Drive answered 404 for it.
+        Returns the forgotten metadata (or None).
+        """
+        metadata = self._files.pop((folder_id, file_name), None)
+        if metadata:
+            self._workbooks.pop(metadata['id'], None)
+        return metadata
+
+    def get_cached_workbook(self, file_id):
+        """
+        Return the last uploaded workbook as a BytesIO if the Drive file has not
+        changed since (same version), otherwise None.
+        """
+        cached = self._workbooks.get(file_id)
+        if not cached:
+            return None
+        version, content = cached
+        if self.get_file_version(file_id) != version:
+            self._workbooks.pop(file_id, None)
+            return None
+        return io.BytesIO(content)
+
+    def remember_workbook(self, file_id, version, content):
+        if version:
+            self._workbooks[file_id] = (version, content)
+
+# Shared Drive client used by the sync
+drive_client = DriveClient()
+
+class SheetsWriter:
+    """
+    Row-level writer for native Google Sheets through the Sheets API.
+    Keeps the header and a registration id -> row index map per spreadsheet
+    and sends only changed/appended rows in one values.batchUpdate call.
+    The map is reused while the Drive version is the one seen after our last
+    write; any other edit to the sheet makes it re-read the id column.
+    """
+
+    def __init__(self, drive):
+        self.drive = drive
+        self._layouts = {}  # spreadsheet_id -> (version, header, row_by_id, next_row)
+
+    def _load_layout(self, spreadsheet_id, sheet_name):
+        values = self.drive.sheets_service.spreadsheets().values()
+        header_rows = values.get(spreadsheetId=spreadsheet_id, range=f"'{sheet_name}'!1:1").execute().get('values', [])
+        header = header_rows[0] if header_rows else []
+
+        row_by_id = {}
+        next_row = 2
+        if 'id' in header:
+            id_column = get_column_letter(header.index('id') + 1)
+            id_columns = values.get(
+                spreadsheetId=spreadsheet_id,
+                range=f"'{sheet_name}'!{id_column}2:{id_column}",
+                majorDimension='COLUMNS'
+            ).execute().get('values', [])
+            ids = id_columns[0] if id_columns else []
+            for offset, registration_id in enumerate(ids):
+                if registration_id != '':
+                    row_by_id[str(registration_id)] = offset + 2
+            next_row = len(ids) + 2
+        elif header:
+            # No id column to match rows by (the id column is added with this
+            # write): append after everything the sheet already holds
+            rows = values.get(spreadsheetId=spreadsheet_id, range=f"'{sheet_name}'").execute().get('values', [])
+            next_row = len(rows) + 1
+        return header, row_by_id, next_row
+
+    def write_registrations(self, spreadsheet_id, registrations, sheet_name='Sheet1'):
+        """
+        Upsert registrations into the sheet by registration id.
+        registrations may be any iterable and is consumed in a single pass.
+        Returns (number of registrations applied, last registration applied).
+        """
+        version = self.drive.get_file_version(spreadsheet_id)
+        cached = self._layouts.get(spreadsheet_id)
+        if cached and cached[0] == version:
+            _, header, row_by_id, next_row = cached
+        else:
+            header, row_by_id, next_row = self._load_layout(spreadsheet_id, sheet_name)
+
+        header_changed = False
+        data = []
+        applied = 0
+        last_registration = None
+        for registration in registrations:
+            for column in registration:
+                if column not in header:
+                    header.append(column)
+                    header_changed = True
+            registration_id = str(registration['id'])
+            row_index = row_by_id.get(registration_id)
+            if row_index is None:
+                row_index = next_row
+                row_by_id[registration_id] = row_index
+                next_row += 1
+            row = ['' if registration.get(column) is None else registration.get(column) for column in header]
+            data.append({'range': f"'{sheet_name}'!A{row_index}", 'values': [row]})
+            applied += 1
+            last_registration = registration
+
+        if header_changed:
+            data.insert(0, {'range': f"'{sheet_name}'!A1", 'values': [header]})
+        if data:
+            self.drive.sheets_service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'valueInputOption': 'RAW', 'data': data}
+            ).execute()
+            version = self.drive.get_file_version(spreadsheet_id)
+
+        self._layouts[spreadsheet_id] = (version, header, row_by_id, next_row)
+        return applied, last_registration
+
+    def invalidate(self, spreadsheet_id):
+        self._layouts.pop(spreadsheet_id, None)
+
+# Shared Sheets API writer used for native Google Sheets targets
+sheets_writer = SheetsWriter(drive_client)
+
+def get_drive_service():
+    """Get the shared Google Drive service instance"""
+    return drive_client.service
+
+def download_excel_file(service, file_id):
+    """Download an xlsx file from Google Drive into an in-memory buffer"""
+    request = service.files().get_media(fileId=file_id)
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, request)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+    buffer.seek(0)
+    return buffer
+
+def update_excel_sheet(excel_buffer, registrations, sheet_name='Sheet1'):
+    """
+    Apply changed registrations to the Excel sheet in place: rows are matched
+    by registration id and updated, new registrations are appended.
+    Other sheets, rows and styles are left untouched.
+    excel_buffer is an in-memory xlsx (BytesIO) and is rewritten with the result.
+    registrations may be any iterable and is consumed in a single pass.
+    Returns (number of registrations applied, last registration applied).
+    """
+    workbook = openpyxl.load_workbook(excel_buffer)
+    if sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+    else:
+        sheet = workbook.create_sheet(sheet_name)
+
+    # Header row defines the column layout; unseen fields become new columns
+    header = [cell.value for cell in sheet[1]]
+    while header and header[-1] is None:
+        header.pop()
+    columns = {name: index + 1 for index, name in enumerate(header)}
+
+    def column_index(name):
+        if name not in columns:
+            columns[name] = len(columns) + 1
+            sheet.cell(row=1, column=columns[name], value=name)
+        return columns[name]
+
+    # Map registration id -> row index of the existing rows
+    row_by_id = {}
+    next_row = 2
+    if 'id' in columns:
+        for row_index, (registration_id,) in enumerate(
+            sheet.iter_rows(min_row=2, min_col=columns['id'], max_col=columns['id'], values_only=True), start=2
+        ):
+            if registration_id is not None:
+                row_by_id[str(registration_id)] = row_index
+                next_row = row_index + 1
+
+    applied = 0
+    last_registration = None
+    for registration in registrations:
+        registration_id = str(registration['id'])
+        row_index = row_by_id.get(registration_id)
+        if row_index is None:
+            row_index = next_row
+            row_by_id[registration_id] = row_index
+            next_row += 1
+        for column, value in registration.items():
+            sheet.cell(row=row_index, column=column_index(column), value=value)
+        applied += 1
+        last_registration = registration
+
+    excel_buffer.seek(0)
+    excel_buffer.truncate()
+    workbook.save(excel_buffer)
+    excel_buffer.seek(0)
+    return applied, last_registration
+
+def write_registrations_xlsx(registrations, fileobj, sheet_name='Sheet1'):
+    """
+    Stream registrations into a new xlsx workbook using openpyxl's write-only
+    mode: rows are written out as the iterable is consumed, so memory stays
+    flat regardless of the number of registrations.
+    Columns follow the field order of the first registration (the table's
+    column order, same layout as Sheet1); values keep their types.
+    Returns (number of registrations written, last registration written).
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    header = None
+    written = 0
+    last_registration = None
+    for registration in registrations:
+        if header is None:
+            header = list(registration.keys())
+            sheet.append(header)
+        sheet.append([registration.get(column) for column in header])
+        written += 1
+        last_registration = registration
+    workbook.save(fileobj)
+    return written, last_registration
+
+def write_registrations_csv(registrations, fileobj):
+    """
+    Stream registrations as CSV into a text file object, same column order
+    as write_registrations_xlsx.
+    Returns (number of registrations written, last registration written).
+    """
+    writer = None
+    written = 0
+    last_registration = None
+    for registration in registrations:
+        if writer is None:
+            writer = csv.DictWriter(fileobj, fieldnames=list(registration.keys()), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(registration)
+        written += 1
+        last_registration = registration
+    return written, last_registration
+
+def upload_excel_file(service, file_id, excel_buffer):
+    """Upload an in-memory xlsx buffer back to Google Drive, replacing the file"""
+    media = MediaIoBaseUpload(excel_buffer, mimetype=XLSX_MIME_TYPE)
+    updated = service.files().update(fileId=file_id, media_body=media, fields='id,version').execute()
+    return updated  # dict with id and the new version
+
+def _sync_changed_registrations_to_drive(watermark):
+    """
+    Apply registrations changed since watermark to the Drive file.
+    Returns 'performed', or 'skipped' when nothing changed since the watermark.
+    """
+    # 1. Stream registrations changed since the last successful sync (with overlap)
+    photosession_registrations = fetch_photosession_registrations_changed_since(
+        watermark, DRIVE_SYNC_WATERMARK_OVERLAP_SECONDS
+    )
+    first_registration = next(photosession_registrations, None)
+    if watermark and first_registration is None:
+        print(f"✅ No registration changes since {watermark}, Google Drive is up to date.")
+        return 'skipped'
+    if first_registration is not None:
+        photosession_registrations = itertools.chain([first_registration], photosession_registrations)
+    
+    # 2. Authenticate and find file in Drive (both cached across runs)
+    service = get_drive_service()
+    folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+    
+    try:
+        file_metadata = drive_client.get_file_metadata(folder_id, DRIVE_FILE_NAME)
+    except FileNotFoundError:
+        print(f"📝 Creating new {DRIVE_FILE_NAME} file in Google Drive...")
+        # A new file needs the full history, not just the latest changes
+        if watermark:
+            photosession_registrations = fetch_photosession_registrations_changed_since(None)
+        # Stream the rows into a temporary xlsx file, page by page
+        with tempfile.TemporaryFile() as export_file:
+            written, last_registration = write_registrations_xlsx(photosession_registrations, export_file)
+            export_file.seek(0)
+            
+            # Upload the new file to Google Drive in chunks
+            file_metadata = {
+                'name': DRIVE_FILE_NAME,
+                'parents': [folder_id]
+            }
+            media = MediaIoBaseUpload(export_file, mimetype=XLSX_MIME_TYPE, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+            file = service.files().create(body=file_metadata, media_body=media, fields='id,name,mimeType,version').execute()
+        file_id = file.get('id')
+        drive_client.remember_file(folder_id, DRIVE_FILE_NAME, file)
+        print(f"✅ Created new file with ID: {file_id} ({written} registrations)")
+        if last_registration:
+            advance_drive_sync_watermark(last_registration)
+        return 'performed'
+    
+    file_id = file_metadata['id']
+    mime_type = file_metadata['mimeType']
+    
+    if mime_type == GOOGLE_SHEET_MIME_TYPE:
+        # 3. Native Google Sheet: write only the changed rows via the Sheets API
+        applied, last_registration = sheets_writer.write_registrations(file_id, photosession_registrations)
+        if last_registration:
+            advance_drive_sync_watermark(last_registration)
+        print(f"✅ Successfully synced {applied} changed photosession registrations to '{DRIVE_FILE_NAME}' (Google Sheet).")
+        return 'performed'
+    
+    # 3. Reuse the workbook uploaded last time if Drive still has that
+    # version, otherwise download it into memory
+    excel_buffer = drive_client.get_cached_workbook(file_id)
+    if excel_buffer is None:
+        excel_buffer = download_excel_file(service, file_id)
+    
+    # 4. Update changed rows of Sheet1 in place
+    applied, last_registration = update_excel_sheet(excel_buffer, photosession_registrations)
+    # 5. Upload back to Drive (replace original)
+    updated = upload_excel_file(service, file_id, excel_buffer)
+    drive_client.remember_workbook(file_id, updated.get('version'), excel_buffer.getvalue())
+    if last_registration:
+        advance_drive_sync_watermark(last_registration)
+    print(f"✅ Successfully synced {applied} changed photosession registrations to '{DRIVE_FILE_NAME}' in Google Drive.")
+    return 'performed'
+
+def sync_photosession_registrations_to_drive():
+    """
+    Incrementally sync photosession registrations to Google Drive Excel file.
+    
+    A cheap fingerprint of the table (row count + newest updated_at) is compared
+    with the one stored after the last successful sync; if they match the run
+    is skipped without any Drive traffic. Otherwise only registrations inserted
+    or modified since the persisted watermark are fetched and applied; the
+    watermark advances after a successful upload. Native Google Sheets are
+    updated row by row through the Sheets API, xlsx files are patched in
+    memory and re-uploaded.
+    
+    Returns 'performed', 'skipped' or 'failed'.
+    """
+    status = 'failed'
+    try:
+        state = get_sync_states(DRIVE_SYNC_WATERMARK_KEY, DRIVE_SYNC_FINGERPRINT_KEY)
+        fingerprint = get_photosession_registrations_fingerprint()
+        if fingerprint == state.get(DRIVE_SYNC_FINGERPRINT_KEY):
+            print("✅ Registrations unchanged since the last sync, skipping Google Drive sync.")
+            status = 'skipped'
+        else:
+            status = _sync_changed_registrations_to_drive(state.get(DRIVE_SYNC_WATERMARK_KEY))
+            set_sync_state(DRIVE_SYNC_FINGERPRINT_KEY, fingerprint)
+    except HttpError as e:
+        if e.resp.status == 404:
+            # The cached file is gone (deleted/moved): resolve it again next run
+            metadata = drive_client.invalidate_file(os.getenv('GOOGLE_DRIVE_FOLDER_ID'), DRIVE_FILE_NAME)
+            if metadata:
+                sheets_writer.invalidate(metadata['id'])
+        print(f"❌ Error syncing photosession registrations to Google Drive: {e}")
+    except Exception as e:
+        print(f"❌ Error syncing photosession registrations to Google Drive: {e}")
+    
+    drive_sync_stats[status] += 1
+    print(f"📊 Google Drive sync runs: {drive_sync_stats['performed']} performed, "
+          f"{drive_sync_stats['skipped']} skipped, {drive_sync_stats['failed']} failed")
+    return status
+
+def advance_drive_sync_watermark(last_registration):
+    """
+    Persist the updated_at of the last synced registration as the watermark.
+    Registrations are streamed ordered by updated_at, so the last one is the newest.
+    """
+    if last_registration.get('updated_at'):
+        set_sync_state(DRIVE_SYNC_WATERMARK_KEY, last_registration['updated_at'])
@@ -0,0 +1,188 @@
+from collections import namedtuple
+from supabase_utils import get_plan_by_id, get_all_plans
+from bot_content import (
+    PLAN_NOT_FOUND_TEXT,
+    ASK_FULL_NAME_TEXT,
+    ASK_PHONE_TEXT,
+    INVALID_PHONE_TEXT,
+    REGISTRATION_SUCCESS_TEXT,
+    REGISTRATION_FAILED_TEXT,
+    SEND_RECEIPT_TEXT,
+    PAYMENT_CONFIRMED_ADMIN_TEXT,
+    PAYMENT_ALREADY_CONFIRMED_TEXT,
+    PAYMENT_CONFIRMATION_FAILED_TEXT,
+    RECEIPT_CONFIRMED_MARK,
+    USE_START_TEXT,
+    cart_text,
+    validate_phone_number,
+    format_phone_number,
+    resolve_plan_id,
+    admin_confirm_markup,
+    payment_instructions_text,
+    admin_registration_text
+)
+from menus import get_menu, plan_callback_data
+from orders import OrderLine, new_cart, update_cart, order_lines, order_total, cart_markup
+
+# Registration funnel shared by the sync (bot.py) and async (async_bot.py)
+# engines: step transitions, cart and order handling and the admin caption.
+# Funnel methods only read and write the state store and return what to
+# show; each engine sends it (and talks to Supabase) in its own way.
+
+# Shown in place of the tapped message; a plain string is sent as a new message
+View = namedtuple('View', ['text', 'reply_markup'])
+
+# Outcome of an admin's confirm tap: the callback answer, whether to mark the
+# receipt message confirmed, and the customer to notify (None if nobody)
+Confirmation = namedtuple('Confirmation', ['answer', 'mark_confirmed', 'customer_chat_id'])
+
+def plan_menu_key(plan_ref):
+    """Menu node of a plan button sent before the menu tree (buy_<plan>), None if the plan is gone"""
+    key = plan_callback_data(resolve_plan_id(plan_ref))
+    return key if get_menu(key) is not None else None
+
+def cart_view(data):
+    """The draft's cart with its total and keyboard"""
+    plans = get_all_plans()
+    lines = order_lines(data['cart'], plans)
+    return View(cart_text(lines, order_total(lines)), cart_markup(data['cart'], plans, data['type']))
+
+def receipt_notification(data):
+    """
+    Caption and confirm keyboard of the receipt forwarded to the admins, None
+    if the draft has no saved order yet (checkout not finished).
+    """
+    registration_id = data.get('registration_id')
+    if not registration_id:
+        return None
+    plan = get_plan_by_id(data['type'])
+    lines = [OrderLine(**item) for item in data.get('order_items', [])]
+    caption = admin_registration_text(data, plan, registration_id, lines, data.get('order_total'))
+    markup = admin_confirm_markup(registration_id)
+    return caption, markup
+
+def confirmed_receipt_caption(caption):
+    return f"{caption}\n\n{RECEIPT_CONFIRMED_MARK}"
+
+class Funnel:
+    """
+    Funnel steps and cart of every chat, kept as (step, draft) in state_store.
+    drive_sync_trigger is notified when a registration is written or paid.
+    """
+
+    def __init__(self, state_store, drive_sync_trigger):
+        self.state_store = state_store
+        self.drive_sync_trigger = drive_sync_trigger
+
+    def draft(self, chat_id):
+        """The chat's draft registration, None if it has none"""
+        state = self.state_store.get(chat_id)
+        return state.data if state is not None else None
+
+    def has_pending_step(self, chat_id):
+        state = self.state_store.get(chat_id)
+        return state is not None and state.step is not None
+
+    def take_step(self, chat_id):
+        """
+        Return the chat's pending (step, draft) and clear the step; the step
+        handler sets the next one. (None, None) if no step is pending.
+        """
+        state = self.state_store.get(chat_id)
+        if state is None or state.step is None:
+            return None, None
+        self.state_store.set(chat_id, None, state.data)
+        return state.step, state.data
+
+    def start_cart(self, chat_id, plan_id):
+        """Open the cart for a plan's 🔐 Оплатить button; returns a View or a text"""
+        if get_plan_by_id(plan_id) is None:
+            return PLAN_NOT_FOUND_TEXT
+
+        # A repeated tap on the same plan keeps the draft being filled in;
+        # otherwise (or once its order is saved) start a new draft with the
+        # plan in the cart, so a receipt is never matched to a stale order
+        state = self.state_store.get(chat_id)
+        if (state is not None and state.data.get('type') == plan_id and 'cart' in state.data
+                and 'registration_id' not in state.data):
+            data = state.data
+        else:
+            data = {'type': plan_id, 'cart': new_cart(plan_id)}
+            self.state_store.set(chat_id, None, data)
+        return cart_view(data)
+
+    def change_cart_item(self, chat_id, plan_id, delta):
+        """Add (delta 1) or remove (delta -1) a unit of plan_id; returns a View or a text"""
+        state = self.state_store.get(chat_id)
+        if state is None or 'cart' not in state.data:
+            return USE_START_TEXT
+        if get_plan_by_id(plan_id) is None:
+            return PLAN_NOT_FOUND_TEXT
+
+        data = state.data
+        data['cart'] = update_cart(data['cart'], plan_id, delta, data['type'])
+        self.state_store.set(chat_id, state.step, data)
+        return cart_view(data)
+
+    def checkout(self, chat_id):
+        """The cart is final; wait for the full name. Returns the text to send"""
+        state = self.state_store.get(chat_id)
+        if state is None or 'cart' not in state.data:
+            return USE_START_TEXT
+        self.state_store.set(chat_id, 'full_name', state.data)
+        return ASK_FULL_NAME_TEXT
+
+    def accept_full_name(self, chat_id, data, full_name):
+        """Returns the texts to send"""
+        data['full_name'] = full_name
+        self.state_store.set(chat_id, 'phone', data)
+        return [ASK_PHONE_TEXT]
+
+    def accept_phone(self, chat_id, data, phone, username):
+        """
+        Validate and store the phone number. Returns the texts to send if it
+        is invalid (the step is kept), None if the order is ready to save.
+        """
+        phone = (phone or '').strip()
+        if not validate_phone_number(phone):
+            self.state_store.set(chat_id, 'phone', data)
+            return [INVALID_PHONE_TEXT]
+
+        data['phone'] = format_phone_number(phone)
+        data['telegram_username'] = username
+        return None
+
+    def order_saved(self, chat_id, data, order):
+        """
+        Record the saved order (None if saving failed) in the draft and wait
+        for the receipt. Returns the texts to send.
+        """
+        if not order:
+            self.state_store.set(chat_id, None, data)
+            return [REGISTRATION_FAILED_TEXT]
+
+        registration_id = order.get('registration_id')
+        data['registration_id'] = registration_id
+        data['order_total'] = order['total']
+        data['order_items'] = order['items']
+        print(f"Created registration ID: {registration_id}, order ID: {order.get('order_id')}")
+        self.state_store.set(chat_id, 'receipt', data)
+        self.drive_sync_trigger.trigger()
+
+        plan = get_plan_by_id(data['type'])
+        return [REGISTRATION_SUCCESS_TEXT, payment_instructions_text(plan, order['total']), SEND_RECEIPT_TEXT]
+
+    def payment_confirmed(self, registration):
+        """
+        Outcome of marking a registration paid: the updated record if this tap
+        marked it paid, None if it already was, False if the update failed.
+        """
+        if registration is False:
+            return Confirmation(PAYMENT_CONFIRMATION_FAILED_TEXT, False, None)
+        if registration is None:
+            # Another tap (this or another admin's copy) got there first
+            return Confirmation(PAYMENT_ALREADY_CONFIRMED_TEXT, True, None)
+
+        self.drive_sync_trigger.trigger()
+        telegram_id = registration.get('telegram_id')
+        return Confirmation(PAYMENT_CONFIRMED_ADMIN_TEXT, True, int(telegram_id) if telegram_id else None)
@@ -1,16 +1,94 @@
-from flask import Flask
+from flask import Flask, request
 import threading
+import queue
+import hmac
+import time
 import os
 
 app = Flask(__name__)
 
+# Telegram webhook route (only active after enable_webhook is called)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+
+_webhook_queue = None
+_webhook_secret = None
+_startup_seconds = None
+# Extra /health fields: name -> callable returning the current value
+_metrics = {}
+
 @app.route('/')
 def health_check():
     return {"status": "healthy", "service": "photosession-bot"}, 200
 
 @app.route('/health')
 def health():
-    return {"status": "healthy", "service": "photosession-bot"}, 200
+    status = {"status": "healthy", "service": "photosession-bot"}
+    if _webhook_queue is not None:
+        status["webhook_queue_depth"] = _webhook_queue.qsize()
+    if _startup_seconds is not None:
+        status["startup_seconds"] = round(_startup_seconds, 3)
+    for name, getter in _metrics.items():
+        status[name] = getter()
+    return status, 200
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Accept a Telegram update and hand it to the worker queue"""
+    if _webhook_queue is None:
+        return {"status": "webhook disabled"}, 404
+
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    # Compared as bytes: str comparison raises TypeError on non-ASCII input
+    if not hmac.compare_digest(token.encode(), _webhook_secret.encode()):
+        return {"status": "forbidden"}, 403
+
+    try:
+        _webhook_queue.put_nowait(request.get_data(as_text=True))
+    except queue.Full:
+        # Telegram redelivers updates that were not acknowledged with 2xx
+        print("⚠️ Webhook queue is full, asking Telegram to retry")
+        return {"status": "busy"}, 503
+
+    return {"status": "ok"}, 200
+
+def _webhook_worker(process_update):
+    while True:
+        json_string = _webhook_queue.get()
+        try:
+            process_update(json_string)
+        except Exception as e:
+            print(f"Error processing webhook update: {e}")
+        finally:
+            _webhook_queue.task_done()
+
+def enable_webhook(process_update, secret_token, workers=2, queue_size=1000):
+    """
+    Enable the webhook route. Updates are queued (bounded by queue_size) and
+    processed by `workers` background threads calling process_update(json_string),
+    so the route can return 200 to Telegram immediately.
+    """
+    global _webhook_queue, _webhook_secret
+    if not secret_token:
+        raise ValueError("A webhook secret token is required")
+
+    _webhook_secret = secret_token
+    _webhook_queue = queue.Queue(maxsize=queue_size)
+    for _ in range(workers):
+        threading.Thread(target=_webhook_worker, args=(process_update,), daemon=True).start()
+
+def register_health_metric(name, getter):
+    """Report getter() as `name` in /health (e.g. queue depths)"""
+    _metrics[name] = getter
+
+def record_startup_time(started_at):
+    """
+    Record the time from process start (a time.perf_counter() value taken
+    before the heavy imports) until the bot is ready to receive updates.
+    Logged and reported by /health so cold starts can be tracked.
+    """
+    global _startup_seconds
+    _startup_seconds = time.perf_counter() - started_at
+    print(f"🚀 Ready to receive updates {_startup_seconds * 1000:.0f} ms after start")
 
 def run_health_server():
     """Run the health check server on a separate thread"""
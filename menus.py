@@ -0,0 +1,112 @@
+import json
+from collections import namedtuple
+from bot_content import (
+    WELCOME_TEXT,
+    CHOOSE_SESSION_TEXT,
+    CHOOSE_EXTRA_TEXT,
+    plan_details_text,
+    prices_text
+)
+from supabase_utils import plan_catalog
+
+# Navigation menus built from a declarative tree and the plan catalog, once
+# per catalog version. Every node keeps its text and its reply_markup
+# already serialized, so a menu tap is a dict lookup plus one send.
+
+MAIN_MENU = 'main_menu'
+
+# callback_data of each menu -> text (or a function rendering it from the
+# plans), static buttons (label, callback_data) and the plan category whose
+# plans are listed after the static buttons
+MENU_TREE = {
+    'main_menu': {
+        'text': WELCOME_TEXT,
+        'buttons': [('🔍 Посмотреть цены', 'see_prices'), ('🛒 Купить фотосессию', 'buy_session')]
+    },
+    'see_prices': {
+        'text': prices_text,
+        'buttons': [('🔙 Главное меню', 'main_menu')]
+    },
+    'buy_session': {
+        'text': CHOOSE_SESSION_TEXT,
+        'buttons': [
+            ('📸 Solo', 'buy_solo'),
+            ('👯 Duo', 'buy_duo'),
+            ('👩‍👩‍👧 Trio', 'buy_trio'),
+            ('✨ Доп. услуги', 'buy_extra'),
+            ('🔙 Главное меню', 'main_menu')
+        ]
+    },
+    'buy_solo': {'text': CHOOSE_SESSION_TEXT, 'buttons': [('🔙 Назад', 'buy_session')], 'category': 'solo'},
+    'buy_duo': {'text': CHOOSE_SESSION_TEXT, 'buttons': [('🔙 Назад', 'buy_session')], 'category': 'duo'},
+    'buy_trio': {'text': CHOOSE_SESSION_TEXT, 'buttons': [('🔙 Назад', 'buy_session')], 'category': 'trio'},
+    'buy_extra': {'text': CHOOSE_EXTRA_TEXT, 'buttons': [('🔙 Назад', 'buy_session')], 'category': 'extra'}
+}
+
+# Menu for plans without a category menu
+DEFAULT_PLAN_PARENT = 'buy_session'
+# Buttons per keyboard row (telebot's InlineKeyboardMarkup default)
+ROW_WIDTH = 3
+
+# reply_markup is the serialized InlineKeyboardMarkup JSON, accepted as-is by send_message
+MenuNode = namedtuple('MenuNode', ['text', 'reply_markup'])
+
+# (catalog version, menus) of the last build
+_menus = None
+
+def plan_callback_data(plan_id):
+    return f'plan_{plan_id}'
+
+def serialize_rows(rows):
+    """Serialize rows of inline button dicts into inline keyboard JSON"""
+    return json.dumps({'inline_keyboard': rows}, ensure_ascii=False)
+
+def serialize_keyboard(buttons):
+    """Serialize (label, callback_data) pairs into inline keyboard JSON, ROW_WIDTH buttons per row"""
+    return serialize_rows([
+        [{'text': label, 'callback_data': data} for label, data in buttons[i:i + ROW_WIDTH]]
+        for i in range(0, len(buttons), ROW_WIDTH)
+    ])
+
+def build_menus(plans):
+    """
+    Build every menu node from MENU_TREE and the plan catalog.
+    Returns {callback_data: MenuNode}, including one 'plan_<id>' node per plan
+    (details + pay button, back to the plan's category menu).
+    """
+    parent_by_category = {node['category']: key for key, node in MENU_TREE.items() if 'category' in node}
+    menus = {}
+    for key, node in MENU_TREE.items():
+        buttons = list(node['buttons'])
+        category = node.get('category')
+        if category:
+            buttons += [(plan['button'], plan_callback_data(plan['id']))
+                        for plan in plans.values() if plan.get('category') == category]
+        text = node['text'](plans) if callable(node['text']) else node['text']
+        menus[key] = MenuNode(text, serialize_keyboard(buttons))
+
+    for plan in plans.values():
+        parent = parent_by_category.get(plan.get('category'), DEFAULT_PLAN_PARENT)
+        menus[plan_callback_data(plan['id'])] = MenuNode(
+            plan_details_text(plan),
+            serialize_keyboard([('🔐 Оплатить', f"pay_{plan['id']}"), ('🔙 Назад', parent)])
+        )
+    return menus
+
+def get_menus():
+    """
+    All menu nodes for the current catalog snapshot, rebuilt on first use
+    after the catalog version changes
+    """
+    global _menus
+    snapshot = plan_catalog.snapshot
+    cached = _menus
+    if cached is None or cached[0] != snapshot.version:
+        cached = (snapshot.version, build_menus(snapshot.plans))
+        # Swapped in whole; a concurrent rebuild just builds the same menus twice
+        _menus = cached
+    return cached[1]
+
+def get_menu(key):
+    """MenuNode for a callback_data, or None"""
+    return get_menus().get(key)
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Admin notification fan-out: every recipient (an admin chat, or a topic of
+# an admin group) is notified concurrently, off the customer's handler, and
+# each delivery is retried on its own.
+
+# thread_id is the forum topic (message_thread_id) for group topics, else None
+Recipient = namedtuple('Recipient', ['chat_id', 'thread_id'])
+
+# Telegram errors that will not go away by retrying (bad request, bot blocked/kicked)
+PERMANENT_ERROR_CODES = (400, 403)
+
+def parse_recipients(value):
+    """
+    Parse a comma-separated recipient list: "chat_id" for a chat or
+    "chat_id:topic_id" for a topic of a forum group,
+    e.g. "12345,-1001234567890:42".
+    """
+    recipients = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        chat_id, _, thread_id = item.partition(':')
+        recipients.append(Recipient(int(chat_id), int(thread_id) if thread_id else None))
+    return recipients
+
+def get_admin_recipients():
+    """Admin recipients from ADMIN_CHAT_IDS, falling back to the single ADMIN_CHAT_ID"""
+    return parse_recipients(os.getenv('ADMIN_CHAT_IDS') or os.getenv('ADMIN_CHAT_ID'))
+
+def thread_kwargs(recipient):
+    """Extra send_* keyword arguments addressing the recipient's topic"""
+    return {'message_thread_id': recipient.thread_id} if recipient.thread_id is not None else {}
+
+def retry_delay(error, attempt, backoff_seconds):
+    """
+    Seconds to wait before retrying a failed delivery, or None if the error
+    is permanent. Honours retry_after from Telegram 429 responses.
+    """
+    error_code = getattr(error, 'error_code', None)
+    if error_code in PERMANENT_ERROR_CODES:
+        return None
+    if error_code == 429:
+        retry_after = (getattr(error, 'result_json', None) or {}).get('parameters', {}).get('retry_after')
+        if retry_after:
+            return retry_after
+    return backoff_seconds * (2 ** attempt)
+
+class NotificationDispatcher:
+    """
+    Send a notification to all recipients concurrently on a small thread pool.
+    dispatch() returns immediately; each recipient is retried up to
+    max_attempts times independently of the others.
+    """
+
+    def __init__(self, recipients, workers=4, max_attempts=3, backoff_seconds=1.0, name='notify'):
+        self.recipients = list(recipients)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def dispatch(self, send, description='notification'):
+        """
+        Call send(recipient) for every recipient in the background.
+        Returns the list of Futures (True if delivered, False if given up).
+        """
+        if not self.recipients:
+            print(f"No recipients configured for {description}")
+        return [self._pool.submit(self._deliver, send, recipient, description) for recipient in self.recipients]
+
+    def _deliver(self, send, recipient, description):
+        for attempt in range(self.max_attempts):
+            try:
+                send(recipient)
+                return True
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.backoff_seconds)
+                if delay is None or attempt == self.max_attempts - 1:
+                    print(f"❌ Failed to send {description} to {recipient.chat_id} "
+                          f"after {attempt + 1} attempt(s): {e}")
+                    return False
+                print(f"Retrying {description} to {recipient.chat_id} in {delay}s: {e}")
+                time.sleep(delay)
+
+class AsyncNotificationDispatcher:
+    """Async counterpart of NotificationDispatcher: one task per recipient on the running loop"""
+
+    def __init__(self, recipients, max_attempts=3, backoff_seconds=1.0):
+        self.recipients = list(recipients)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        # Keep references so pending deliveries are not garbage collected
+        self._tasks = set()
+
+    def dispatch(self, send, description='notification'):
+        """
+        Schedule `await send(recipient)` for every recipient and return the
+        tasks immediately (each resolves to True if delivered).
+        """
+        if not self.recipients:
+            print(f"No recipients configured for {description}")
+        tasks = []
+        for recipient in self.recipients:
+            task = asyncio.create_task(self._deliver(send, recipient, description))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            tasks.append(task)
+        return tasks
+
+    async def _deliver(self, send, recipient, description):
+        for attempt in range(self.max_attempts):
+            try:
+                await send(recipient)
+                return True
+            except Exception as e:
+                delay = retry_delay(e, attempt, self.backoff_seconds)
+                if delay is None or attempt == self.max_attempts - 1:
+                    print(f"❌ Failed to send {description} to {recipient.chat_id} "
+                          f"after {attempt + 1} attempt(s): {e}")
+                    return False
+                print(f"Retrying {description} to {recipient.chat_id} in {delay}s: {e}")
+                await asyncio.sleep(delay)
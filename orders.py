@@ -0,0 +1,61 @@
+import os
+from collections import namedtuple
+from menus import plan_callback_data, serialize_rows
+
+# Cart and order model shared by the sync and async engines. The cart is kept
+# in the conversation draft as {plan_id: quantity}; 'type' is the plan the
+# checkout was started from and stays in the cart with at least one unit.
+# The order is written in one request and priced by the database (see
+# create_photosession_order in database_setup.sql).
+
+# Units of one item a customer can add
+MAX_ITEM_QUANTITY = int(os.getenv('MAX_ORDER_ITEM_QUANTITY', 10))
+# Plans offered as add-ons on the cart screen
+EXTRA_CATEGORY = 'extra'
+
+OrderLine = namedtuple('OrderLine', ['plan_id', 'name', 'unit_price', 'quantity'])
+
+def new_cart(plan_id):
+    return {plan_id: 1}
+
+def update_cart(cart, plan_id, delta, main_plan_id):
+    """
+    Return a copy of cart with plan_id's quantity changed by delta, kept
+    between 0 (dropped) and MAX_ITEM_QUANTITY; the main plan never drops below 1.
+    """
+    cart = dict(cart)
+    minimum = 1 if plan_id == main_plan_id else 0
+    quantity = max(minimum, min(MAX_ITEM_QUANTITY, cart.get(plan_id, 0) + delta))
+    if quantity:
+        cart[plan_id] = quantity
+    else:
+        cart.pop(plan_id, None)
+    return cart
+
+def order_lines(cart, plans):
+    """OrderLines of the cart priced from the catalog; plans no longer offered are left out"""
+    return [
+        OrderLine(plan_id, plans[plan_id]['name'], plans[plan_id]['price'], quantity)
+        for plan_id, quantity in cart.items()
+        if plan_id in plans and quantity > 0
+    ]
+
+def order_total(lines):
+    return sum(line.unit_price * line.quantity for line in lines)
+
+def cart_markup(cart, plans, main_plan_id):
+    """
+    Cart keyboard: a ➕ button for every extra (with ➖ once it is in the
+    cart), then checkout and back to the main plan's details.
+    """
+    rows = []
+    for plan in plans.values():
+        if plan.get('category') != EXTRA_CATEGORY:
+            continue
+        row = [{'text': f"➕ {plan['name']}", 'callback_data': f"add_{plan['id']}"}]
+        if cart.get(plan['id'], 0) > (1 if plan['id'] == main_plan_id else 0):
+            row.append({'text': '➖', 'callback_data': f"remove_{plan['id']}"})
+        rows.append(row)
+    rows.append([{'text': '✅ Оформить заказ', 'callback_data': 'checkout'}])
+    rows.append([{'text': '🔙 Назад', 'callback_data': plan_callback_data(main_plan_id)}])
+    return serialize_rows(rows)
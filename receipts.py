@@ -0,0 +1,109 @@
+import os
+import tempfile
+from collections import namedtuple
+import requests
+
+# Payment receipts are forwarded to the admin by Telegram file_id, so the
+# bytes never pass through the bot. The streamed, size-capped download below
+# is only a fallback for when the bytes are really needed (re-upload after a
+# rejected file_id, archival).
+
+# Bot API getFile only serves files up to 20 MB
+RECEIPT_MAX_BYTES = int(os.getenv('RECEIPT_MAX_BYTES', 20 * 1024 * 1024))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Downloads larger than this spill from memory to a temporary file
+DOWNLOAD_SPOOL_SIZE = 1024 * 1024
+
+# kind is 'photo' or 'document'
+Receipt = namedtuple('Receipt', ['kind', 'file_id', 'file_size', 'file_name'])
+
+class ReceiptTooLarge(Exception):
+    pass
+
+def is_receipt_document(document):
+    """PDFs and image files sent as documents are accepted as receipts"""
+    mime_type = document.mime_type or ''
+    return mime_type == 'application/pdf' or mime_type.startswith('image/')
+
+def get_receipt(message):
+    """Return the Receipt carried by a message, or None if it has no usable photo/document"""
+    if message.photo:
+        # Largest photo size
+        photo = message.photo[-1]
+        return Receipt('photo', photo.file_id, photo.file_size, None)
+    if message.document and is_receipt_document(message.document):
+        document = message.document
+        return Receipt('document', document.file_id, document.file_size, document.file_name)
+    return None
+
+def receipt_send_kwargs(receipt, content=None):
+    """
+    Keyword arguments for bot.send_photo / bot.send_document forwarding the
+    receipt: the file_id by default, or downloaded content when given.
+    """
+    media = receipt.file_id if content is None else content
+    if receipt.kind == 'photo':
+        return {'photo': media}
+    kwargs = {'document': media}
+    if content is not None and receipt.file_name:
+        kwargs['visible_file_name'] = receipt.file_name
+    return kwargs
+
+def _file_url(token, file_path):
+    return f"https://api.telegram.org/file/bot{token}/{file_path}"
+
+def _check_size(size, max_bytes):
+    if size is not None and int(size) > max_bytes:
+        raise ReceiptTooLarge(f"Receipt is {size} bytes, limit is {max_bytes}")
+
+def download_receipt(bot, receipt, max_bytes=RECEIPT_MAX_BYTES, timeout=30):
+    """
+    Stream a receipt from Telegram into a spooled temporary file, at most
+    max_bytes. Returns the file object positioned at the start; the caller
+    closes it.
+    """
+    _check_size(receipt.file_size, max_bytes)
+    file_info = bot.get_file(receipt.file_id)
+    _check_size(file_info.file_size, max_bytes)
+
+    content = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+    try:
+        with requests.get(_file_url(bot.token, file_info.file_path), stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            _check_size(response.headers.get('Content-Length'), max_bytes)
+            size = 0
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                _check_size(size, max_bytes)
+                content.write(chunk)
+    except Exception:
+        content.close()
+        raise
+    content.seek(0)
+    return content
+
+async def download_receipt_async(bot, receipt, max_bytes=RECEIPT_MAX_BYTES, timeout=30):
+    """Async counterpart of download_receipt for the AsyncTeleBot engine"""
+    # Imported here so the sync engine never loads aiohttp
+    import aiohttp
+
+    _check_size(receipt.file_size, max_bytes)
+    file_info = await bot.get_file(receipt.file_id)
+    _check_size(file_info.file_size, max_bytes)
+
+    content = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async with session.get(_file_url(bot.token, file_info.file_path)) as response:
+                response.raise_for_status()
+                _check_size(response.content_length, max_bytes)
+                size = 0
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    _check_size(size, max_bytes)
+                    content.write(chunk)
+    except Exception:
+        content.close()
+        raise
+    content.seek(0)
+    return content
@@ -0,0 +1,306 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Central outbound queue for Bot API sends. Every send is released within
+# Telegram's flood limits: a global token bucket for the whole bot plus one
+# bucket per private chat or group. 429 responses put the job back in its
+# chat's queue after retry_after instead of failing it.
+
+# Lower value = sent first
+PRIORITY_HIGH = 0      # admin notifications and payment confirmations
+PRIORITY_NORMAL = 5    # replies in the registration funnel
+PRIORITY_LOW = 10      # broadcasts, reminders, marketing
+
+# Telegram limits: ~30 messages/second overall, ~1 message/second per chat,
+# 20 messages/minute per group
+SEND_RATE_GLOBAL = float(os.getenv('SEND_RATE_GLOBAL', 30))
+SEND_RATE_PER_CHAT = float(os.getenv('SEND_RATE_PER_CHAT', 1))
+SEND_RATE_PER_GROUP_PER_MINUTE = float(os.getenv('SEND_RATE_PER_GROUP_PER_MINUTE', 20))
+MAX_SEND_ATTEMPTS = 5
+# Per-chat buckets kept before idle ones are dropped
+MAX_CHAT_BUCKETS = 10000
+
+def telegram_retry_after(error):
+    """retry_after seconds of a Telegram 429 error, None for any other error"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    return (getattr(error, 'result_json', None) or {}).get('parameters', {}).get('retry_after') or 1
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class SendJob:
+    """One queued Bot API call: call(chat_id, *args, **kwargs)"""
+
+    __slots__ = ('call', 'chat_id', 'args', 'kwargs', 'priority', 'seq', 'future', 'attempts')
+
+    def __init__(self, call, chat_id, args, kwargs, priority, seq, future):
+        self.call = call
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.attempts = 0
+
+class SendScheduler:
+    """
+    Scheduling state shared by OutboundQueue and AsyncOutboundQueue (no I/O,
+    callers hold their own lock). Jobs of one chat are sent one at a time in
+    (priority, submission) order, so replies never overtake each other;
+    across chats the highest-priority sendable job goes first.
+    """
+
+    def __init__(self, global_rate=SEND_RATE_GLOBAL, chat_rate=SEND_RATE_PER_CHAT,
+                 group_rate_per_minute=SEND_RATE_PER_GROUP_PER_MINUTE, max_attempts=MAX_SEND_ATTEMPTS):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.max_attempts = max_attempts
+        self.depth = 0  # queued + in flight
+        self._seq = itertools.count()
+        self._chat_jobs = {}      # chat_id -> heap of (priority, seq, job)
+        self._buckets = {}        # chat_id -> TokenBucket
+        self._blocked_until = {}  # chat_id -> monotonic time from a 429 retry_after
+        self._ready = []          # heap of (priority, seq, chat_id), lazily invalidated
+        self._delayed = []        # heap of (ready_at, chat_id)
+        self._in_flight = set()
+
+    def new_job(self, call, chat_id, args, kwargs, priority, future):
+        return SendJob(call, chat_id, args, kwargs, priority, next(self._seq), future)
+
+    def add(self, job):
+        heapq.heappush(self._chat_jobs.setdefault(job.chat_id, []), (job.priority, job.seq, job))
+        self.depth += 1
+        self._schedule(job.chat_id)
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CHAT_BUCKETS:
+                self._prune_buckets(now)
+            # Groups and channels have negative ids
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 3, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, 3, now)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self, now):
+        """Drop buckets of idle chats; a full bucket is the same as a new one"""
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._chat_jobs and chat_id not in self._in_flight and bucket.is_full(now)]:
+            del self._buckets[chat_id]
+
+    def _schedule(self, chat_id):
+        """Offer the chat's head job on the ready heap unless the chat has a send in flight"""
+        jobs = self._chat_jobs.get(chat_id)
+        if jobs and chat_id not in self._in_flight:
+            priority, seq, _ = jobs[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+    def next_job(self, now):
+        """
+        Take the next job that may be sent now.
+        Returns (job, None), or (None, seconds to wait) when nothing is
+        sendable yet; the wait is None when the queue is empty.
+        """
+        while self._delayed and self._delayed[0][0] <= now:
+            _, chat_id = heapq.heappop(self._delayed)
+            self._schedule(chat_id)
+
+        while self._ready:
+            priority, seq, chat_id = self._ready[0]
+            jobs = self._chat_jobs.get(chat_id)
+            if chat_id in self._in_flight or not jobs or jobs[0][:2] != (priority, seq):
+                heapq.heappop(self._ready)  # stale entry
+                continue
+
+            bucket = self._bucket(chat_id, now)
+            chat_wait = max(self._blocked_until.get(chat_id, 0) - now, bucket.wait_time(now))
+            if chat_wait > 0:
+                heapq.heappop(self._ready)
+                heapq.heappush(self._delayed, (now + chat_wait, chat_id))
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                return None, global_wait
+
+            heapq.heappop(self._ready)
+            _, _, job = heapq.heappop(jobs)
+            if not jobs:
+                del self._chat_jobs[chat_id]
+            self._blocked_until.pop(chat_id, None)
+            self.global_bucket.consume(now)
+            bucket.consume(now)
+            self._in_flight.add(chat_id)
+            job.attempts += 1
+            return job, None
+
+        if self._delayed:
+            return None, max(0, self._delayed[0][0] - now)
+        return None, None
+
+    def finished(self, job, error, now):
+        """
+        Record a finished send. A 429 puts the job back at the head of its
+        chat's queue, blocked for retry_after. Returns the retry_after
+        applied, or None if the job is done (sent or failed for good).
+        """
+        self._in_flight.discard(job.chat_id)
+        retry_after = telegram_retry_after(error) if error is not None else None
+        if retry_after is not None and job.attempts < self.max_attempts:
+            self._blocked_until[job.chat_id] = now + retry_after
+            heapq.heappush(self._chat_jobs.setdefault(job.chat_id, []), (job.priority, job.seq, job))
+        else:
+            retry_after = None
+            self.depth -= 1
+        self._schedule(job.chat_id)
+        return retry_after
+
+class OutboundQueue:
+    """
+    Outbound queue for the threaded TeleBot engine. submit() returns a
+    concurrent.futures.Future immediately; a dispatcher thread releases jobs
+    within the rate limits to a small pool of sender threads.
+    """
+
+    def __init__(self, workers=4, **limits):
+        self._scheduler = SendScheduler(**limits)
+        self._condition = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbound')
+        threading.Thread(target=self._dispatch_loop, name='outbound-dispatcher', daemon=True).start()
+
+    @property
+    def depth(self):
+        """Jobs queued or in flight"""
+        with self._condition:
+            return self._scheduler.depth
+
+    def submit(self, call, chat_id, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Queue call(chat_id, *args, **kwargs); returns a Future with its result"""
+        with self._condition:
+            job = self._scheduler.new_job(call, chat_id, args, kwargs, priority, Future())
+            self._scheduler.add(job)
+            self._condition.notify()
+        return job.future
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                job, wait = self._scheduler.next_job(time.monotonic())
+                if job is None:
+                    self._condition.wait(wait)
+                    continue
+            self._pool.submit(self._send, job)
+
+    def _send(self, job):
+        result, error = None, None
+        try:
+            result = job.call(job.chat_id, *job.args, **job.kwargs)
+        except Exception as e:
+            error = e
+        with self._condition:
+            retry_after = self._scheduler.finished(job, error, time.monotonic())
+            self._condition.notify()
+
+        if retry_after is not None:
+            print(f"⚠️ Rate limited sending to {job.chat_id}, retrying in {retry_after}s")
+        elif error is not None:
+            print(f"Error sending to {job.chat_id}: {error}")
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+class AsyncOutboundQueue:
+    """
+    Outbound queue for the AsyncTeleBot engine: same scheduling, with a
+    dispatcher task on the running event loop and one task per send.
+    submit() returns an asyncio.Future.
+    """
+
+    def __init__(self, **limits):
+        self._scheduler = SendScheduler(**limits)
+        self._wakeup = None
+        self._dispatcher = None
+        self._sends = set()
+
+    @property
+    def depth(self):
+        """Jobs queued or in flight"""
+        return self._scheduler.depth
+
+    def submit(self, call, chat_id, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Queue `await call(chat_id, *args, **kwargs)`; returns a Future with its result"""
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch_loop())
+        job = self._scheduler.new_job(call, chat_id, args, kwargs, priority, loop.create_future())
+        self._scheduler.add(job)
+        self._wakeup.set()
+        return job.future
+
+    async def _dispatch_loop(self):
+        while True:
+            job, wait = self._scheduler.next_job(time.monotonic())
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._send(job))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, job):
+        result, error = None, None
+        try:
+            result = await job.call(job.chat_id, *job.args, **job.kwargs)
+        except Exception as e:
+            error = e
+        retry_after = self._scheduler.finished(job, error, time.monotonic())
+        self._wakeup.set()
+
+        if job.future.done():
+            return  # the caller stopped waiting
+        if retry_after is not None:
+            print(f"⚠️ Rate limited sending to {job.chat_id}, retrying in {retry_after}s")
+        elif error is not None:
+            print(f"Error sending to {job.chat_id}: {error}")
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
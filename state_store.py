@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+
+# Conversation state for one chat: the current funnel step (or None when no
+# step is pending) and the draft registration collected so far
+ConversationState = namedtuple('ConversationState', ['step', 'data'])
+
+class MemoryStateStore:
+    """
+    In-memory conversation state with LRU eviction and per-entry TTL.
+    Entries are kept as (expires_at, step, data) tuples.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        """Return the ConversationState for chat_id, or None if missing/expired"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return None
+            expires_at, step, data = entry
+            if expires_at < time.time():
+                del self._entries[chat_id]
+                return None
+            self._entries.move_to_end(chat_id)
+            return ConversationState(step, dict(data))
+
+    def set(self, chat_id, step, data):
+        """Store the step and draft for chat_id and refresh its expiry"""
+        with self._lock:
+            self._entries[chat_id] = (time.time() + self.ttl_seconds, step, dict(data))
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def purge_expired(self):
+        """Drop all expired entries, returns how many were removed"""
+        now = time.time()
+        with self._lock:
+            expired = [chat_id for chat_id, entry in self._entries.items() if entry[0] < now]
+            for chat_id in expired:
+                del self._entries[chat_id]
+        return len(expired)
+
+class SQLiteStateStore:
+    """
+    Conversation state persisted in a local SQLite file, so half-finished
+    funnels survive restarts. Drafts are stored as compact JSON with an
+    expiry timestamp.
+    """
+
+    def __init__(self, path='conversation_state.db', ttl_seconds=24 * 60 * 60):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS conversation_state (
+                chat_id INTEGER PRIMARY KEY,
+                step TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self.purge_expired()
+
+    def get(self, chat_id):
+        """Return the ConversationState for chat_id, or None if missing/expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT step, data, expires_at FROM conversation_state WHERE chat_id = ?",
+                (chat_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            step, data, expires_at = row
+            if expires_at < time.time():
+                self._conn.execute("DELETE FROM conversation_state WHERE chat_id = ?", (chat_id,))
+                return None
+        return ConversationState(step, json.loads(data))
+
+    def set(self, chat_id, step, data):
+        """Store the step and draft for chat_id and refresh its expiry"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_state (chat_id, step, data, expires_at) VALUES (?, ?, ?, ?)",
+                (chat_id, step, payload, time.time() + self.ttl_seconds)
+            )
+
+    def delete(self, chat_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversation_state WHERE chat_id = ?", (chat_id,))
+
+    def purge_expired(self):
+        """Drop all expired entries, returns how many were removed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM conversation_state WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+def create_state_store():
+    """
+    Build the state store configured by environment variables:
+    STATE_STORE ('memory' or 'sqlite'), STATE_DB_PATH, STATE_TTL_MINUTES, STATE_MAX_ENTRIES.
+    """
+    backend = os.getenv('STATE_STORE', 'sqlite').lower()
+    ttl_seconds = int(os.getenv('STATE_TTL_MINUTES', 24 * 60)) * 60
+
+    if backend == 'memory':
+        return MemoryStateStore(
+            max_entries=int(os.getenv('STATE_MAX_ENTRIES', 10000)),
+            ttl_seconds=ttl_seconds
+        )
+    if backend == 'sqlite':
+        return SQLiteStateStore(os.getenv('STATE_DB_PATH', 'conversation_state.db'), ttl_seconds=ttl_seconds)
+    raise ValueError(f"Unknown STATE_STORE backend: {backend}")
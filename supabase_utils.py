@@ -1,226 +1,332 @@
 import os
+import time
+import threading
 import requests
-import json
+from types import MappingProxyType
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from datetime import datetime, timezone
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
-import io
-import pandas as pd
+from datetime import datetime, timedelta, timezone
 
 load_dotenv()
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_API_KEY')
 
-HEADERS = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json"
-}
+PHOTOSESSION_REGISTRATIONS_TABLE = 'photosession_registrations'
+SYNC_STATE_TABLE = 'sync_state'
+PLANS_TABLE = 'photosession_plans'
+# Stored function writing a registration with its order and line items
+CREATE_ORDER_RPC = 'rpc/create_photosession_order'
+# The same unpaid checkout (plan, name, phone and cart) repeated within this
+# window returns the order already saved instead of writing another one
+REGISTRATION_REUSE_WINDOW_MINUTES = int(os.getenv('REGISTRATION_REUSE_WINDOW_MINUTES', 30))
+
+# Page size for paginated registration reads (Supabase caps responses at 1000 rows by default)
+REGISTRATIONS_PAGE_SIZE = int(os.getenv('SUPABASE_PAGE_SIZE', 1000))
+
+# HTTP statuses worth retrying: rate limiting and transient gateway/server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class SupabaseClient:
+    """
+    Pooled, keep-alive client for the Supabase REST (PostgREST) API.
+    All calls share one requests.Session, so repeated calls reuse warm
+    TCP/TLS connections instead of opening a new one every time.
+    """
+
+    def __init__(self, url, api_key, pool_size=10, timeout=(3.05, 10), max_retries=3, backoff_factor=0.5):
+        self.base_url = f"{url}/rest/v1"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def endpoint(self, table):
+        """Build the REST endpoint URL for a table"""
+        return f"{self.base_url}/{table}"
+
+    def _should_retry(self, method, status_code):
+        # POST is not idempotent: a 5xx may mean the row was written anyway,
+        # so only retry it when the server explicitly rate-limited the call.
+        if method == 'POST':
+            return status_code == 429
+        return status_code in RETRY_STATUSES
+
+    def _backoff_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    def request(self, method, table, params=None, json=None, headers=None, timeout=None):
+        """
+        Send a request to a table endpoint, retrying with exponential backoff
+        on connection errors and on 5xx/429 responses.
+        Returns the final requests.Response.
+        """
+        method = method.upper()
+        url = self.endpoint(table)
+        timeout = timeout or self.timeout
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(
+                    method, url, params=params, json=json, headers=headers, timeout=timeout
+                )
+            except requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+
+            if attempt < self.max_retries and self._should_retry(method, response.status_code):
+                print(f"Supabase {method} {table} returned {response.status_code}, retrying...")
+                time.sleep(self._backoff_delay(attempt, response))
+                continue
+            return response
 
-# Hardcoded plans for photosessions
+    def get(self, table, params=None, **kwargs):
+        return self.request('GET', table, params=params, **kwargs)
+
+    def post(self, table, json=None, **kwargs):
+        return self.request('POST', table, json=json, **kwargs)
+
+    def patch(self, table, json=None, params=None, **kwargs):
+        return self.request('PATCH', table, params=params, json=json, **kwargs)
+
+# Shared client used by all helpers below
+supabase_client = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
+
+# Built-in plan catalog: served until the photosession_plans table has been
+# loaded, and whenever it is unreachable or empty (database_setup.sql seeds
+# the table with the same rows). 'category' is the menu the plan is listed
+# in, 'button' its label there (see menus.py), 'features' the bullets of the
+# price list and 'price_note' an optional suffix to its price there.
 PHOTOSESSION_PLANS = {
     'solo1': {
         'id': 'solo1',
         'name': 'Solo Базовый',
         'price': 200000,
-        'description': '1 парящее платье, макияж и прическа, все снимки без обработки, 5 обработанных фотографий'
+        'description': '1 парящее платье, макияж и прическа, все снимки без обработки, 5 обработанных фотографий',
+        'category': 'solo',
+        'button': '💫 Solo Базовый',
+        'features': [
+            '1 парящее платье',
+            'Макияж и прическа',
+            'Все снимки без обработки (в течение 3-4 дней после съемки)',
+            '5 обработанных фотографий (в течение 4 недель после съемки)',
+            'Ассистент (входит во все пакеты - помогает надевать платье, подгоняет под фигуру, работает с подолом и образом во время съемки)'
+        ]
     },
     'solo2': {
-        'id': 'solo2', 
+        'id': 'solo2',
         'name': 'Premium Solo',
         'price': 280000,
-        'description': '1 парящее платье, макияж и причёска, все снимки без обработки, 12 обработанных фото'
+        'description': '1 парящее платье, макияж и причёска, все снимки без обработки, 12 обработанных фото',
+        'category': 'solo',
+        'button': '👑 Premium Solo',
+        'features': [
+            '1 парящее платье',
+            'Макияж и причёска',
+            'Все снимки без обработки (в течение 3-4 дней после съемки)',
+            '12 обработанных фото (приоритетная обработка, в течение 10 дней после съемки)',
+            'Ассистент (входит во все пакеты - полный функционал)'
+        ]
     },
     'solo3': {
         'id': 'solo3',
         'name': 'VIP',
         'price': 360000,
-        'description': '2 парящих платья, макияж и причёска, все снимки без обработки, 25 обработанных фото'
+        'description': '2 парящих платья, макияж и причёска, все снимки без обработки, 25 обработанных фото',
+        'category': 'solo',
+        'button': '🥇VIP',
+        'features': [
+            '2 парящих платья (смена образа во время съемки)',
+            'Макияж и причёска',
+            'Все снимки без обработки (в течение 3-4 дней после съемки)',
+            '25 обработанных фото (в течение 4 недель)',
+            'Приоритетная дата съемки',
+            'Ассистент (входит во все пакеты - полный функционал)'
+        ]
     },
     'duo': {
         'id': 'duo',
         'name': 'Два поколения',
         'price': 360000,
-        'description': '1 парящее платье на каждую участницу, макияж и прическа для обеих, 15 обработанных фото'
+        'description': '1 парящее платье на каждую участницу, макияж и прическа для обеих, 15 обработанных фото',
+        'category': 'duo',
+        'button': '👩‍👧 Два поколения',
+        'features': [
+            '1 парящее платье на каждую участницу',
+            'Макияж и прическа для обеих',
+            'Все снимки без обработки (в течение 3–4 дней после съемки)',
+            '15 обработанных фото (в течение 4 недель)',
+            'Ассистент (помощь с образами, подолом, позированием)'
+        ]
     },
     'trio': {
         'id': 'trio',
         'name': 'Три поколения',
         'price': 440000,
-        'description': '1 парящее платье на каждую участницу, макияж и прическа для трёх, 20 обработанных фото'
+        'description': '1 парящее платье на каждую участницу, макияж и прическа для трёх, 20 обработанных фото',
+        'category': 'trio',
+        'button': '👩‍👧‍👵 Три поколения',
+        'features': [
+            '1 парящее платье на каждую участницу',
+            'Макияж и прическа для трёх',
+            'Все снимки без обработки (в течение 3–4 дней после съемки)',
+            '20 обработанных фото (в течение 4 недель)',
+            'Ассистент (работает с каждой участницей)'
+        ]
     },
     'extra1': {
         'id': 'extra1',
         'name': 'Видео Reels',
         'price': 70000,
-        'description': 'Короткое видео (15–30 сек)'
+        'description': 'Короткое видео (15–30 сек)',
+        'category': 'extra',
+        'button': 'Видео Reels / короткое видео (15–30 сек)'
     },
     'extra2': {
         'id': 'extra2',
         'name': 'Дополнительное платье',
         'price': 25000,
-        'description': 'Дополнительное парящее платье'
+        'description': 'Дополнительное парящее платье',
+        'category': 'extra',
+        'button': 'Дополнительное платье'
     },
     'extra3': {
         'id': 'extra3',
         'name': 'Дополнительное фото',
         'price': 5000,
-        'description': 'Дополнительное обработанное фото'
+        'description': 'Дополнительное обработанное фото',
+        'category': 'extra',
+        'button': 'Дополнительное обработанное фото',
+        'price_note': 'за 1 шт.'
     }
 }
 
-def get_service_account_credentials():
+# Columns read from photosession_plans; rows are served in sort_order
+PLAN_COLUMNS = 'id,name,price,description,category,button,features,price_note'
+# How often the plan catalog is reloaded from Supabase
+PLAN_CATALOG_TTL_SECONDS = int(os.getenv('PLAN_CATALOG_TTL_SECONDS', 300))
+
+def fetch_photosession_plans():
     """
-    Get Google service account credentials from environment variable.
-    Returns credentials object for Google APIs.
+    Fetch the active plans from the 'photosession_plans' table in sort order.
+    Returns a list of dicts, or None if the table could not be read.
     """
-    service_account_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
-    if not service_account_json:
-        raise ValueError("GOOGLE_SERVICE_ACCOUNT_JSON not found in environment variables")
-    
-    try:
-        # Parse the JSON string from environment variable
-        service_account_info = json.loads(service_account_json)
-        return service_account.Credentials.from_service_account_info(service_account_info)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_JSON: {e}")
-
-def get_drive_service():
-    """Get Google Drive service instance"""
-    creds = get_service_account_credentials()
-    return build('drive', 'v3', credentials=creds)
-
-def find_file_metadata(service, folder_id, file_name):
-    """Find file metadata in Google Drive folder"""
-    query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
-    results = service.files().list(q=query, fields="files(id, name, mimeType)").execute()
-    files = results.get('files', [])
-    if not files:
-        raise FileNotFoundError(f"File '{file_name}' not found in folder '{folder_id}'")
-    return files[0]  # returns dict with id, name, mimeType
-
-def download_excel_file(service, file_id, mime_type, local_path):
-    """Download file from Google Drive"""
-    if mime_type == 'application/vnd.google-apps.spreadsheet':
-        # Export Google Sheet as Excel
-        request = service.files().export_media(fileId=file_id, mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    else:
-        # Download native Excel file
-        request = service.files().get_media(fileId=file_id)
-    fh = io.FileIO(local_path, 'wb')
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.close()
-
-def update_excel_sheet(local_path, registrations):
-    """Update Excel sheet with new data"""
-    # Load Excel file
-    with pd.ExcelWriter(local_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-        df = pd.DataFrame(registrations)
-        df.to_excel(writer, sheet_name='Sheet1', index=False)
-    # openpyxl preserves other sheets/styles
-
-def upload_excel_file(service, file_id, local_path, mime_type):
-    """Upload file back to Google Drive"""
-    if mime_type == 'application/vnd.google-apps.spreadsheet':
-        # Re-upload as Google Sheet (convert Excel to Google Sheet)
-        media = MediaFileUpload(local_path, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        updated = service.files().update(
-            fileId=file_id,
-            media_body=media,
-            body={'mimeType': 'application/vnd.google-apps.spreadsheet'}
-        ).execute()
-    else:
-        # Replace Excel file
-        media = MediaFileUpload(local_path, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        updated = service.files().update(fileId=file_id, media_body=media).execute()
-    return updated
-
-def sync_photosession_registrations_to_drive():
-    """Sync photosession registrations to Google Drive Excel file"""
     try:
-        # 1. Fetch photosession registrations from Supabase
-        photosession_registrations = fetch_photosession_registrations()
-        
-        # 2. Authenticate and find file in Drive
-        service = get_drive_service()
-        folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
-        
-        try:
-            file_metadata = find_file_metadata(service, folder_id, 'PhotosessionRegistrations.xlsx')
-            file_id = file_metadata['id']
-            mime_type = file_metadata['mimeType']
-            # 3. Download the file (export if Google Sheet)
-            local_path = 'PhotosessionRegistrations.xlsx'
-            download_excel_file(service, file_id, mime_type, local_path)
-        except FileNotFoundError:
-            print("📝 Creating new PhotosessionRegistrations.xlsx file in Google Drive...")
-            # Create a new Excel file with photosession registrations data
-            df = pd.DataFrame(photosession_registrations)
-            df.to_excel('PhotosessionRegistrations.xlsx', index=False)
-            
-            # Upload the new file to Google Drive
-            file_metadata = {
-                'name': 'PhotosessionRegistrations.xlsx',
-                'parents': [folder_id]
-            }
-            media = MediaFileUpload('PhotosessionRegistrations.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            file_id = file.get('id')
-            print(f"✅ Created new file with ID: {file_id}")
-            return
-        
-        # 4. Update Sheet1
-        update_excel_sheet(local_path, photosession_registrations)
-        # 5. Upload back to Drive (replace original, convert if needed)
-        upload_excel_file(service, file_id, local_path, mime_type)
-        print(f"✅ Successfully synced photosession registrations to 'PhotosessionRegistrations.xlsx' in Google Drive.")
+        response = supabase_client.get(
+            PLANS_TABLE,
+            params={"select": PLAN_COLUMNS, "is_active": "eq.true", "order": "sort_order.asc,id.asc"}
+        )
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        print(f"❌ Error syncing photosession registrations to Google Drive: {e}")
+        print(f"Exception fetching photosession plans: {e}")
+        return None
+
+def _freeze_plan(plan):
+    """Read-only copy of a plan row; list values become tuples"""
+    return MappingProxyType({
+        key: tuple(value) if isinstance(value, list) else value
+        for key, value in plan.items()
+        if value is not None
+    })
+
+# version increases every time the catalog content changes; plans maps
+# plan id -> read-only plan, in catalog order
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['version', 'plans', 'loaded_at'])
+
+class PlanCatalog:
+    """
+    In-process cache of the plan catalog. Readers only dereference the
+    current immutable snapshot, so lookups are lock-free dict accesses;
+    refresh() builds a new snapshot off the hot path and swaps it in with a
+    single assignment. A failed or empty load keeps the current snapshot.
+    The bot calls refresh() every ttl_seconds from its scheduler and on
+    demand (/reload_plans).
+    """
+
+    def __init__(self, loader, fallback, ttl_seconds=PLAN_CATALOG_TTL_SECONDS):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.snapshot = self._build_snapshot(0, fallback.values())
+        self._refresh_lock = threading.Lock()
+
+    @staticmethod
+    def _build_snapshot(version, rows):
+        plans = {row['id']: _freeze_plan(row) for row in rows}
+        return CatalogSnapshot(version, MappingProxyType(plans), time.monotonic())
+
+    def get(self, plan_id):
+        return self.snapshot.plans.get(plan_id)
+
+    def all(self):
+        return self.snapshot.plans
+
+    def refresh(self):
+        """
+        Reload the catalog now. Returns the current snapshot; its version only
+        changes when plans actually changed. Concurrent calls share one load.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            # A refresh is already running; wait for it instead of loading twice
+            with self._refresh_lock:
+                return self.snapshot
+        try:
+            rows = self.loader()
+            current = self.snapshot
+            if not rows:
+                if rows is not None:
+                    print("⚠️ Plan catalog table is empty, keeping the current plans")
+                return current
+
+            snapshot = self._build_snapshot(current.version, rows)
+            if list(snapshot.plans.items()) != list(current.plans.items()):
+                snapshot = snapshot._replace(version=current.version + 1)
+                print(f"🔄 Plan catalog v{snapshot.version} loaded: {len(snapshot.plans)} plans")
+            self.snapshot = snapshot
+            return snapshot
+        finally:
+            self._refresh_lock.release()
+
+# Shared catalog used by get_plan_by_id / get_all_plans
+plan_catalog = PlanCatalog(fetch_photosession_plans, PHOTOSESSION_PLANS)
 
 def get_plan_by_id(plan_id):
-    """Get plan details by plan ID"""
-    return PHOTOSESSION_PLANS.get(plan_id)
+    """Get plan details by plan ID from the current catalog snapshot"""
+    return plan_catalog.get(plan_id)
 
 def get_all_plans():
-    """Get all available plans"""
-    return PHOTOSESSION_PLANS
+    """Get all available plans (read-only mapping of plan id -> plan) in catalog order"""
+    return plan_catalog.all()
 
-def save_photosession_registration_to_supabase(user_data, telegram_id, username=None):
+def build_photosession_registration_data(user_data, telegram_id, username=None):
     """
-    Save photosession registration to Supabase photosession_registrations table.
-    Returns True if successful, False otherwise.
-    
-    Required table schema:
-    CREATE TABLE photosession_registrations (
-      id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
-      full_name TEXT NOT NULL,
-      phone_number TEXT NOT NULL,
-      telegram_username TEXT,
-      telegram_id TEXT NOT NULL,
-      plan_id TEXT NOT NULL,
-      plan_name TEXT NOT NULL,
-      is_paid BOOLEAN DEFAULT FALSE,
-      created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-    );
+    Build the photosession_registrations row for a finished funnel.
+    Returns None if the selected plan does not exist.
     """
-    print("save_photosession_registration_to_supabase called with:", user_data, telegram_id)
-    
-    PHOTOSESSION_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/photosession_registrations"
-    
     # Get plan details
     plan_id = user_data.get('type')
     plan = get_plan_by_id(plan_id)
     
     if not plan:
         print(f"Invalid plan_id: {plan_id}")
-        return False
+        return None
     
-    data = {
+    return {
         "full_name": user_data.get("full_name"),
         "phone_number": user_data.get("phone"),
         "telegram_username": f"@{username}" if username else None,
@@ -230,50 +336,81 @@ def save_photosession_registration_to_supabase(user_data, telegram_id, username=
         "is_paid": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    
-    print("Photosession registration data to send:", data)
-    print("Endpoint:", PHOTOSESSION_REGISTRATIONS_ENDPOINT)
-    print("Headers:", HEADERS)
-    
+
+def build_photosession_order_request(user_data, telegram_id, username=None):
+    """
+    Build the create_photosession_order arguments for a finished checkout:
+    the registration row plus the cart's line items (plan id and quantity,
+    priced by the database). Returns None if the selected plan does not exist.
+    """
+    registration = build_photosession_registration_data(user_data, telegram_id, username)
+    if not registration:
+        return None
+
+    cart = user_data.get('cart') or {registration['plan_id']: 1}
+    return {
+        "registration": registration,
+        "items": [{"plan_id": plan_id, "quantity": quantity} for plan_id, quantity in cart.items() if quantity > 0],
+        "reuse_window_minutes": REGISTRATION_REUSE_WINDOW_MINUTES
+    }
+
+def save_photosession_order_to_supabase(user_data, telegram_id, username=None):
+    """
+    Save a checkout (registration, order and its line items) in one request
+    through the create_photosession_order function; it runs in a single
+    transaction, returns the order already saved for the same checkout
+    repeated within REGISTRATION_REUSE_WINDOW_MINUTES, and computes the
+    prices and total from photosession_plans.
+    Returns {'registration_id', 'order_id', 'total', 'items'} if successful,
+    None otherwise.
+    """
+    data = build_photosession_order_request(user_data, telegram_id, username)
+    if not data:
+        return None
+
     try:
-        response = requests.post(PHOTOSESSION_REGISTRATIONS_ENDPOINT, json=data, headers=HEADERS)
-        print("Supabase response:", response.status_code, response.text)
-        
-        if response.status_code in (200, 201):
-            print("Photosession registration saved to Supabase.")
-            return True
-        else:
-            print(f"Failed to save photosession registration: {response.status_code} {response.text}")
-            return False
+        response = supabase_client.post(CREATE_ORDER_RPC, json=data)
+        if response.status_code == 200:
+            order = response.json()
+            print(f"Photosession order {order.get('order_id')} saved to Supabase, total {order.get('total')}.")
+            return order
+        print(f"Failed to save photosession order: {response.status_code} {response.text}")
+        return None
     except Exception as e:
-        print(f"Exception during Supabase photosession registration: {e}")
-        return False
+        print(f"Exception during Supabase photosession order: {e}")
+        return None
 
 def update_photosession_payment_status(registration_id):
     """
-    Update photosession registration payment status to paid in Supabase.
+    Mark a photosession registration as paid in Supabase. Only an unpaid row
+    is updated, so repeated confirmations (several admins, double taps) are
+    no-ops. Returns the registration record if this call marked it paid, None
+    if it was already paid (or does not exist), False on failure.
     """
     print(f"update_photosession_payment_status called with registration_id: {registration_id}")
     
-    PHOTOSESSION_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/photosession_registrations"
-    
     data = {
         "is_paid": True
     }
     
     print("Payment update data to send:", data)
-    print("Endpoint:", f"{PHOTOSESSION_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}")
+    print("Endpoint:", f"{supabase_client.endpoint(PHOTOSESSION_REGISTRATIONS_TABLE)}?id=eq.{registration_id}")
     
     try:
-        response = requests.patch(
-            f"{PHOTOSESSION_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}",
+        response = supabase_client.patch(
+            PHOTOSESSION_REGISTRATIONS_TABLE,
             json=data,
-            headers=HEADERS
+            params={"id": f"eq.{registration_id}", "is_paid": "eq.false"},
+            headers={"Prefer": "return=representation"}
         )
         print("Supabase response:", response.status_code, response.text)
-        if response.status_code in (200, 204):
+        if response.status_code == 200:
+            registrations = response.json()
+            if not registrations:
+                print("Photosession payment was already confirmed.")
+                return None
             print("Photosession payment status updated in Supabase.")
-            return True
+            return registrations[0]
         else:
             print(f"Failed to update payment status: {response.status_code} {response.text}")
             return False
@@ -285,12 +422,10 @@ def get_photosession_registration_by_id(registration_id):
     """
     Get photosession registration details by ID from Supabase.
     """
-    PHOTOSESSION_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/photosession_registrations"
-    
     try:
-        response = requests.get(
-            f"{PHOTOSESSION_REGISTRATIONS_ENDPOINT}?id=eq.{registration_id}",
-            headers=HEADERS
+        response = supabase_client.get(
+            PHOTOSESSION_REGISTRATIONS_TABLE,
+            params={"id": f"eq.{registration_id}"}
         )
         response.raise_for_status()
         registrations = response.json()
@@ -303,12 +438,10 @@ def get_latest_photosession_registration_by_telegram_id(telegram_id):
     """
     Get the latest photosession registration for a specific telegram_id from Supabase.
     """
-    PHOTOSESSION_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/photosession_registrations"
-    
     try:
-        response = requests.get(
-            f"{PHOTOSESSION_REGISTRATIONS_ENDPOINT}?telegram_id=eq.{telegram_id}&order=created_at.desc&limit=1",
-            headers=HEADERS
+        response = supabase_client.get(
+            PHOTOSESSION_REGISTRATIONS_TABLE,
+            params={"telegram_id": f"eq.{telegram_id}", "order": "created_at.desc", "limit": 1}
         )
         response.raise_for_status()
         registrations = response.json()
@@ -317,17 +450,119 @@ def get_latest_photosession_registration_by_telegram_id(telegram_id):
         print(f"Exception getting latest photosession registration: {e}")
         return None
 
+def iter_photosession_registrations(page_size=None, select=None, order_column='created_at', after=None):
+    """
+    Stream photosession registrations page by page using keyset pagination
+    on (order_column, id), so memory stays flat regardless of table size.
+    
+    select: optional list of columns to return (order_column and id are always included)
+    after: only return registrations whose order_column is greater than this value
+    
+    Yields dicts. HTTP errors are raised to the caller.
+    """
+    page_size = page_size or REGISTRATIONS_PAGE_SIZE
+    params = {
+        "order": f"{order_column}.asc,id.asc",
+        "limit": page_size
+    }
+    if select:
+        columns = list(select)
+        for key_column in (order_column, 'id'):
+            if key_column not in columns:
+                columns.append(key_column)
+        params["select"] = ",".join(columns)
+    if after:
+        params[order_column] = f"gt.{after}"
+    
+    while True:
+        response = supabase_client.get(PHOTOSESSION_REGISTRATIONS_TABLE, params=params)
+        response.raise_for_status()
+        page = response.json()
+        yield from page
+        if len(page) < page_size:
+            return
+        
+        # Continue strictly after the last (order_column, id) of this page
+        last = page[-1]
+        params.pop(order_column, None)
+        params["or"] = (
+            f'({order_column}.gt."{last[order_column]}",'
+            f'and({order_column}.eq."{last[order_column]}",id.gt.{last["id"]}))'
+        )
+
 def fetch_photosession_registrations():
     """
     Fetch all photosession registrations from the Supabase 'photosession_registrations' table.
-    Returns a list of dicts.
+    Returns a list of dicts. Use iter_photosession_registrations to stream large tables.
     """
-    PHOTOSESSION_REGISTRATIONS_ENDPOINT = f"{SUPABASE_URL}/rest/v1/photosession_registrations"
-    
     try:
-        response = requests.get(PHOTOSESSION_REGISTRATIONS_ENDPOINT, headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
+        return list(iter_photosession_registrations())
     except Exception as e:
         print(f"Exception fetching photosession registrations: {e}")
         return []
+
+def fetch_photosession_registrations_changed_since(watermark=None, overlap_seconds=0):
+    """
+    Stream photosession registrations inserted or modified after the given
+    updated_at watermark (all registrations if watermark is None),
+    ordered by updated_at. Returns a generator of dicts.
+    
+    updated_at is stamped before its transaction commits, so a row can become
+    visible after rows with a later updated_at were read; overlap_seconds
+    starts the read that much before the watermark to pick such rows up.
+    Rows already seen are returned again, so callers must apply them by id.
+    """
+    if watermark and overlap_seconds:
+        watermark = (datetime.fromisoformat(watermark) - timedelta(seconds=overlap_seconds)).isoformat()
+    return iter_photosession_registrations(order_column='updated_at', after=watermark)
+
+def get_photosession_registrations_fingerprint():
+    """
+    Cheap fingerprint of the registrations table: row count plus the newest
+    updated_at, read from a single one-row request. Changes whenever a
+    registration is inserted, modified or deleted.
+    """
+    response = supabase_client.get(
+        PHOTOSESSION_REGISTRATIONS_TABLE,
+        params={"select": "updated_at", "order": "updated_at.desc", "limit": 1},
+        headers={"Prefer": "count=exact"}
+    )
+    response.raise_for_status()
+    rows = response.json()
+    # Content-Range looks like "0-0/42" (or "*/0" for an empty table)
+    total = response.headers.get('Content-Range', '*/0').split('/')[-1]
+    latest = rows[0]['updated_at'] if rows else ''
+    return f"{total}:{latest}"
+
+def get_sync_states(*keys):
+    """Get several values from the sync_state table in one request, as a dict of key -> value"""
+    try:
+        response = supabase_client.get(
+            SYNC_STATE_TABLE,
+            params={"key": f"in.({','.join(keys)})", "select": "key,value"}
+        )
+        response.raise_for_status()
+        return {row['key']: row['value'] for row in response.json()}
+    except Exception as e:
+        print(f"Exception getting sync state {keys}: {e}")
+        return {}
+
+def get_sync_state(key):
+    """Get a value from the sync_state table, None if not set"""
+    return get_sync_states(key).get(key)
+
+def set_sync_state(key, value):
+    """Upsert a value into the sync_state table. Returns True if successful."""
+    try:
+        response = supabase_client.post(
+            SYNC_STATE_TABLE,
+            json={"key": key, "value": value, "updated_at": datetime.now(timezone.utc).isoformat()},
+            headers={"Prefer": "resolution=merge-duplicates"}
+        )
+        if response.status_code in (200, 201, 204):
+            return True
+        print(f"Failed to set sync state '{key}': {response.status_code} {response.text}")
+        return False
+    except Exception as e:
+        print(f"Exception setting sync state '{key}': {e}")
+        return False
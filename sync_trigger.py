@@ -0,0 +1,103 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class DebouncedTrigger:
+    """
+    Coalesce bursts of trigger() calls into a single run of `action`.
+    The action runs `debounce_seconds` after the last trigger, but never later
+    than `max_delay_seconds` after the first trigger of the burst, so a steady
+    stream of events cannot postpone it forever. Runs on a timer thread.
+    """
+
+    def __init__(self, action, debounce_seconds=60, max_delay_seconds=300, name='trigger'):
+        self.action = action
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.name = name
+        self._lock = threading.Lock()
+        self._timer = None
+        self._first_trigger = None
+
+    def trigger(self):
+        """Request a run; returns immediately"""
+        with self._lock:
+            now = time.monotonic()
+            if self._first_trigger is None:
+                self._first_trigger = now
+            deadline = min(now + self.debounce_seconds, self._first_trigger + self.max_delay_seconds)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(0, deadline - now), self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._first_trigger = None
+
+    def _fire(self):
+        with self._lock:
+            # A trigger() that got the lock first replaced this timer; the
+            # replacement runs the action and keeps the burst's anchor
+            if self._timer is not threading.current_thread():
+                return
+            self._timer = None
+            self._first_trigger = None
+        try:
+            self.action()
+        except Exception as e:
+            print(f"Error running debounced {self.name}: {e}")
+
+class SingleFlightExecutor:
+    """
+    Run `action` on a dedicated background thread, at most one run at a time.
+    A request that arrives while a run is in progress joins it (gets the same
+    Future) and schedules one follow-up run, so changes made during the run
+    are picked up too; any number of joined requests share that follow-up.
+    """
+
+    def __init__(self, action, name='sync'):
+        self.action = action
+        self.name = name
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._current = None
+        self._rerun_requested = False
+
+    @property
+    def running(self):
+        with self._lock:
+            return self._current is not None and not self._current.done()
+
+    def submit(self):
+        """
+        Start a run, or join the one in progress.
+        Returns (Future with the action's result, joined flag).
+        """
+        with self._lock:
+            if self._current is not None and not self._current.done():
+                self._rerun_requested = True
+                return self._current, True
+            self._current = self._pool.submit(self._run)
+            return self._current, False
+
+    def run(self):
+        """Start or join a run and block until it finishes; returns the action's result"""
+        future, _ = self.submit()
+        return future.result()
+
+    def _run(self):
+        try:
+            return self.action()
+        except Exception as e:
+            print(f"Error running {self.name}: {e}")
+            raise
+        finally:
+            with self._lock:
+                if self._rerun_requested:
+                    self._rerun_requested = False
+                    self._current = self._pool.submit(self._run)
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import subprocess
+
+# Drive export isolated in a child process: openpyxl and Google API memory and CPU
+# stay out of the bot process, which only sends a small job descriptor and
+# gets a status dict back (one JSON object per line over stdin/stdout).
+
+WORKER_SCRIPT = os.path.abspath(__file__)
+# A job running longer than this is considered hung: the worker is killed
+# (and restarted for the next job) and the run counts as failed
+DRIVE_SYNC_TIMEOUT_SECONDS = int(os.getenv('DRIVE_SYNC_TIMEOUT_SECONDS', 15 * 60))
+
+def run_sync_job(job):
+    """Run one sync job inside the worker process and return its status"""
+    # Imported here so the export stack is loaded in the worker, not the bot
+    from drive_sync import sync_photosession_registrations_to_drive
+
+    started = time.monotonic()
+    if job.get('job') == 'drive_sync':
+        status = sync_photosession_registrations_to_drive()
+    else:
+        print(f"Unknown sync job: {job}")
+        status = 'failed'
+    return {
+        'job': job.get('job'),
+        'status': status,
+        'duration_seconds': round(time.monotonic() - started, 2)
+    }
+
+def export_registrations(path):
+    """
+    Stream all registrations into a local .xlsx or .csv file (chosen by extension).
+    Returns the number of registrations written.
+    """
+    from supabase_utils import fetch_photosession_registrations_changed_since
+    from drive_sync import write_registrations_csv, write_registrations_xlsx
+
+    registrations = fetch_photosession_registrations_changed_since(None)
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as export_file:
+            written, _ = write_registrations_csv(registrations, export_file)
+    else:
+        with open(path, 'wb') as export_file:
+            written, _ = write_registrations_xlsx(registrations, export_file)
+    return written
+
+def serve():
+    """Worker loop: read jobs from stdin, write results to stdout"""
+    protocol = sys.stdout
+    # Log output from the sync goes to stderr so it can't corrupt the protocol
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = run_sync_job(json.loads(line))
+        except Exception as e:
+            print(f"❌ Sync job crashed: {e}")
+            result = {'job': None, 'status': 'failed', 'duration_seconds': 0}
+        protocol.write(json.dumps(result) + '\n')
+        protocol.flush()
+
+def read_replies(stream, replies):
+    """Forward the worker's reply lines to a queue; '' marks end of output"""
+    for line in stream:
+        replies.put(line)
+    replies.put('')
+
+class SyncWorkerProcess:
+    """
+    Long-lived child process running sync jobs one at a time.
+    The child keeps its Drive caches between jobs and is restarted
+    transparently if it dies or a job exceeds timeout_seconds.
+    """
+
+    def __init__(self, timeout_seconds=DRIVE_SYNC_TIMEOUT_SECONDS):
+        self.timeout_seconds = timeout_seconds
+        self._process = None
+        self._replies = None
+        self._lock = threading.Lock()
+
+    def _get_process(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                [sys.executable, '-u', WORKER_SCRIPT, '--serve'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True
+            )
+            # Replies are read on a thread so waiting for one can time out
+            self._replies = queue.Queue()
+            threading.Thread(
+                target=read_replies,
+                args=(self._process.stdout, self._replies),
+                name='drive-sync-worker-reader',
+                daemon=True
+            ).start()
+        return self._process
+
+    def _discard_process(self, process):
+        process.kill()
+        process.wait()
+        self._process = None
+        self._replies = None
+
+    def run_drive_sync(self):
+        """Run the Drive sync in the worker process; returns 'performed', 'skipped' or 'failed'"""
+        job = {'job': 'drive_sync', 'requested_at': time.time()}
+        with self._lock:
+            process = self._get_process()
+            try:
+                process.stdin.write(json.dumps(job) + '\n')
+                process.stdin.flush()
+                line = self._replies.get(timeout=self.timeout_seconds)
+            except queue.Empty:
+                print(f"❌ Drive sync worker did not answer within {self.timeout_seconds}s, restarting it")
+                self._discard_process(process)
+                return 'failed'
+            except (BrokenPipeError, OSError) as e:
+                line = ''
+                print(f"Error talking to Drive sync worker: {e}")
+            if not line:
+                print("❌ Drive sync worker process died, it will be restarted")
+                self._discard_process(process)
+                return 'failed'
+        result = json.loads(line)
+        print(f"🧵 Drive sync worker finished: {result['status']} in {result['duration_seconds']}s")
+        return result['status']
+
+    def shutdown(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                self._process.wait(timeout=10)
+            self._process = None
+            self._replies = None
+
+if __name__ == "__main__":
+    if '--serve' in sys.argv:
+        serve()
+    elif '--export' in sys.argv:
+        # Local export: python sync_worker.py --export registrations.csv
+        path = sys.argv[sys.argv.index('--export') + 1]
+        print(f"✅ Exported {export_registrations(path)} registrations to {path}")
+    else:
+        # One-off sync from the command line (e.g. a cron job): python sync_worker.py
+        print(run_sync_job({'job': 'drive_sync', 'requested_at': time.time()}))